@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+"""
+bench_all.py
+
+The x9k3 benchmark suite.
+
+Builds deterministic MPEG-TS streams with tsgen.py and measures
+
+    * X9K3.decode packets per second
+    * X9K3._write_segment and X9K3._write_m3u8 latency while decoding
+    * X9K3._write_m3u8 cost as a VOD playlist grows
+    * X9K3._chk_sidecar_cues cost as the sidecar schedule grows
+    * cold start, import x9k3, X9K3() and a short VOD job
+
+Results are written as JSON. Run it with each interpreter,
+or list them with -I, and compare against an older run with -c.
+
+    python3 bench/bench_all.py -o results.json
+    python3 bench/bench_all.py -I python3 pypy3 -o results.json
+    python3 bench/bench_all.py -c old.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Share of a timing that counts as a regression with -c
+THRESHOLD = 0.10
+
+
+def argue():
+    """
+    argue parse command line args
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o", "--output", default=None, help="JSON results file [default:stdout]"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=float, default=60, help="Stream seconds [default:60]"
+    )
+    parser.add_argument(
+        "-b", "--bitrate", type=int, default=2000000, help="Video bitrate [default:2000000]"
+    )
+    parser.add_argument(
+        "-g", "--gop", type=int, default=60, help="Frames per GOP [default:60]"
+    )
+    parser.add_argument(
+        "-p", "--pids", type=int, default=2, help="Number of A/V pids [default:2]"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Runs per timing, best is kept [default:3]"
+    )
+    parser.add_argument(
+        "-I",
+        "--interpreters",
+        nargs="+",
+        default=None,
+        help="Run the suite with each interpreter, like python3 pypy3 [default:this one]",
+    )
+    parser.add_argument(
+        "-c", "--compare", default=None, help="Older JSON results to compare with"
+    )
+    return parser.parse_args()
+
+
+def latency(samples):
+    """
+    latency returns count, mean, p50, p95 and max
+    of samples in microseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    count = len(samples)
+    return {
+        "count": count,
+        "mean_us": round(sum(samples) / count * 1e6, 1),
+        "p50_us": round(samples[count // 2] * 1e6, 1),
+        "p95_us": round(samples[min(int(count * 0.95), count - 1)] * 1e6, 1),
+        "max_us": round(samples[-1] * 1e6, 1),
+    }
+
+
+def timed(samples, func):
+    """
+    timed wraps func, appending the seconds
+    each call takes to samples.
+    """
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        samples.append(time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+def decode(ts_file, out_dir, extra=None):
+    """
+    decode runs X9K3.decode on ts_file and returns
+    the seconds it took, and the latency samples
+    of _write_segment and _write_m3u8.
+    addendum sleeps half a second, sleeps are not timed.
+    """
+    from x9k3 import X9K3, argue as x9_argue  # pylint: disable=import-outside-toplevel
+
+    x9 = X9K3()
+    x9.args = x9_argue(["-i", ts_file, "-o", out_dir] + (extra or []))
+    segs, m3u8s = [], []
+    x9._write_segment = timed(segs, x9._write_segment)
+    x9._write_m3u8 = timed(m3u8s, x9._write_m3u8)
+    sleep = time.sleep
+    time.sleep = lambda secs: None
+    try:
+        start = time.perf_counter()
+        x9.decode()
+        return time.perf_counter() - start, segs, m3u8s
+    finally:
+        time.sleep = sleep
+
+
+def bench_decode(args, work_dir):
+    """
+    bench_decode returns packets per second and
+    write latency for decoding a generated stream,
+    with in stream cues, sidecar cues, batch scanning, and mmap input.
+    """
+    from tsgen import PKT_SIZE, TSGen, mk_break_cues, write_sidecar  # pylint: disable=import-outside-toplevel
+
+    cues = mk_break_cues(20.0, 30.0, 10.0, int(args.duration // 30))
+    ts_cues = os.path.join(work_dir, "cues.ts")
+    ts_plain = os.path.join(work_dir, "plain.ts")
+    sidecar = os.path.join(work_dir, "sidecar.txt")
+    TSGen(args.duration, args.bitrate, gop=args.gop, pids=args.pids, cues=cues).write(
+        ts_cues
+    )
+    TSGen(args.duration, args.bitrate, gop=args.gop, pids=args.pids).write(ts_plain)
+    write_sidecar(sidecar, cues)
+    runs = {
+        "in_stream_cues": (ts_cues, []),
+        "sidecar_cues": (ts_plain, ["-s", sidecar]),
+        "batch": (ts_cues, ["-b"]),
+        "mmap": (ts_cues, ["--mmap"]),
+    }
+    results = {}
+    for name, (ts_file, extra) in runs.items():
+        pkts = os.path.getsize(ts_file) // PKT_SIZE
+        best = None
+        for rep in range(args.repeat):
+            out_dir = os.path.join(work_dir, f"{name}{rep}")
+            secs, segs, m3u8s = decode(ts_file, out_dir, extra)
+            if best is None or secs < best[0]:
+                best = (secs, segs, m3u8s)
+        secs, segs, m3u8s = best
+        results[name] = {
+            "packets": pkts,
+            "seconds": round(secs, 4),
+            "packets_per_sec": round(pkts / secs),
+            "write_segment": latency(segs),
+            "write_m3u8": latency(m3u8s),
+        }
+    return results
+
+
+def bench_playlist():
+    """
+    bench_playlist returns _write_m3u8 microseconds
+    per segment as the VOD playlist grows.
+    """
+    from bench_playlist import per_segment  # pylint: disable=import-outside-toplevel
+
+    return {
+        str(count): round(secs * 1e6, 1)
+        for count, secs in per_segment([100, 1000, 5000])
+    }
+
+
+def bench_sidecar():
+    """
+    bench_sidecar returns _chk_sidecar_cues nanoseconds
+    per packet as the sidecar schedule grows.
+    """
+    from bench_sidecar import per_packet  # pylint: disable=import-outside-toplevel
+
+    return {
+        str(count): round(per_packet(count) * 1e9, 1) for count in [0, 100, 10000]
+    }
+
+
+def bench_startup():
+    """
+    bench_startup returns cold start timings.
+    """
+    from bench_startup import startup  # pylint: disable=import-outside-toplevel
+
+    return startup()
+
+
+def suite(args):
+    """
+    suite runs every benchmark with this interpreter.
+    """
+    from x9k3 import version  # pylint: disable=import-outside-toplevel
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        decoded = bench_decode(args, work_dir)
+    return {
+        "interpreter": platform.python_implementation(),
+        "python": platform.python_version(),
+        "x9k3": version(),
+        "stream": {
+            "duration": args.duration,
+            "bitrate": args.bitrate,
+            "gop": args.gop,
+            "pids": args.pids,
+        },
+        "decode": decoded,
+        "write_m3u8_us_per_segment": bench_playlist(),
+        "chk_sidecar_cues_ns_per_packet": bench_sidecar(),
+        "startup": bench_startup(),
+    }
+
+
+def run_interpreters(args):
+    """
+    run_interpreters runs the suite with each of args.interpreters
+    and returns the results keyed by interpreter.
+    """
+    results = {}
+    argv = [
+        "-d", str(args.duration), "-b", str(args.bitrate),
+        "-g", str(args.gop), "-p", str(args.pids), "-r", str(args.repeat),
+    ]  # fmt: skip
+    for interp in args.interpreters:
+        try:
+            proc = subprocess.run(
+                [interp, os.path.abspath(__file__)] + argv,
+                stdout=subprocess.PIPE,
+                check=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as err:
+            results[interp] = {"error": str(err)}
+            continue
+        results[interp] = json.loads(proc.stdout)
+    return results
+
+
+TIMINGS = {
+    "packets_per_sec", "mean_us", "p95_us",
+    "import_ms", "construct_us", "vod_job_ms",
+}  # fmt: skip
+SCALING = {"write_m3u8_us_per_segment", "chk_sidecar_cues_ns_per_packet"}
+
+
+def _timings(results, path=()):
+    """
+    _timings yields (path, value) for each timing in results.
+    packets_per_sec is higher is better, everything else is lower.
+    """
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _timings(value, path + (key,))
+        elif key in TIMINGS or (path and path[-1] in SCALING):
+            yield path + (key,), value
+
+
+def compare(old, new):
+    """
+    compare returns a list of timings
+    more than THRESHOLD worse in new than in old.
+    """
+    old_timings = dict(_timings(old))
+    regressions = []
+    for path, value in _timings(new):
+        was = old_timings.get(path)
+        if not was or not value:
+            continue
+        change = (value - was) / was
+        if path[-1] == "packets_per_sec":
+            change = -change
+        if change > THRESHOLD:
+            regressions.append(
+                {"timing": "/".join(path), "old": was, "new": value, "worse": f"{change:.1%}"}
+            )
+    return regressions
+
+
+def main():
+    """
+    main runs the suite and writes JSON results.
+    """
+    args = argue()
+    if args.interpreters:
+        results = run_interpreters(args)
+    else:
+        results = suite(args)
+    if args.compare:
+        with open(args.compare, encoding="utf8") as old:
+            results["regressions"] = compare(json.load(old), results)
+    text = json.dumps(results, indent=3)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as out:
+            out.write(text + "\n")
+    else:
+        print(text)
+    if args.compare and results["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
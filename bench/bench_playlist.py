@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+
+"""
+bench_playlist.py
+
+Per segment cost of X9K3._write_m3u8
+as the VOD playlist grows.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from x9k3 import X9K3, Chunk  # pylint: disable=wrong-import-position
+
+SAMPLE = 100
+
+
+def add_segment(x9):
+    """
+    add_segment adds a segment to the window
+    and writes the playlist the way X9K3._write_segment does.
+    """
+    seg_file = f"seg{x9.segnum}.ts"
+    chunk = Chunk(seg_file, seg_file, x9.segnum)
+    chunk.add_tag("#EXTINF", "2.000000,")
+    x9.window.slide_panes(chunk)
+    x9._write_m3u8()
+
+
+def per_segment(lengths):
+    """
+    per_segment yields (playlist length, seconds per segment)
+    for each length in lengths.
+    """
+    with tempfile.TemporaryDirectory() as out_dir:
+        x9 = X9K3()
+        x9.args.output_dir = out_dir
+        x9.segnum = 0
+        for length in lengths:
+            while x9.segnum < length:
+                add_segment(x9)
+            start = time.perf_counter()
+            for _ in range(SAMPLE):
+                add_segment(x9)
+            yield length, (time.perf_counter() - start) / SAMPLE
+
+
+if __name__ == "__main__":
+    print("segments\tus/segment")
+    for count, secs in per_segment([100, 1000, 5000, 9000]):
+        print(f"{count}\t\t{secs * 1e6:.1f}")
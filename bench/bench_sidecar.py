@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""
+bench_sidecar.py
+
+Per packet cost of X9K3._chk_sidecar_cues
+as the number of scheduled sidecar cues grows.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from x9k3 import X9K3  # pylint: disable=wrong-import-position
+
+CUE = "/DAlAAAAAAAAAP/wFAUAAAABf+/+ABt3QP4ADbugAAEAAAAABhboVw=="
+PKTS = 100000
+
+
+def per_packet(num_cues):
+    """
+    per_packet returns the seconds per packet
+    for _chk_sidecar_cues with num_cues scheduled
+    ahead of the current segment.
+    """
+    x9 = X9K3()
+    x9.started = 10.0
+    x9.next_start = 12.0
+    for i in range(num_cues):
+        x9.add2sidecar(f"{100.0 + i * 60}, {CUE}")
+    secs = timeit.repeat(lambda: x9._chk_sidecar_cues(256), number=PKTS, repeat=5)
+    return min(secs) / PKTS
+
+
+if __name__ == "__main__":
+    print("cues\tns/packet")
+    for count in [0, 10, 100, 1000, 10000]:
+        print(f"{count}\t{per_packet(count) * 1e9:.1f}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+bench_startup.py
+
+Cold start cost of x9k3 for short per file jobs.
+
+    * importing x9k3 in a new interpreter
+    * X9K3() construction
+    * a X9K3 VOD job on a 4 second stream, in process
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+RUNS = 10
+
+
+def import_ms(runs=RUNS):
+    """
+    import_ms returns the best milliseconds
+    to start an interpreter and import x9k3,
+    and to start an interpreter that imports nothing.
+    """
+
+    def best(code):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True)
+            times.append(time.perf_counter() - start)
+        return min(times) * 1000
+
+    return best("import x9k3"), best("pass")
+
+
+def construct_us():
+    """
+    construct_us returns microseconds per X9K3()
+    """
+    from x9k3 import X9K3  # pylint: disable=import-outside-toplevel
+
+    number = 1000
+    return min(timeit.repeat(X9K3, number=number, repeat=3)) / number * 1e6
+
+
+def job_ms(runs=RUNS):
+    """
+    job_ms returns the best milliseconds for a X9K3 VOD job
+    on a 4 second stream. addendum sleeps are not timed.
+    """
+    from tsgen import TSGen  # pylint: disable=import-outside-toplevel
+    from x9k3 import X9K3, Config  # pylint: disable=import-outside-toplevel
+
+    times = []
+    sleep = time.sleep
+    time.sleep = lambda secs: None
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            ts_file = os.path.join(work_dir, "job.ts")
+            TSGen(4).write(ts_file)
+            for run in range(runs):
+                out_dir = os.path.join(work_dir, str(run))
+                start = time.perf_counter()
+                X9K3(args=Config(input=ts_file, output_dir=out_dir)).decode()
+                times.append(time.perf_counter() - start)
+    finally:
+        time.sleep = sleep
+    return min(times) * 1000
+
+
+def startup():
+    """
+    startup returns all the cold start timings.
+    """
+    with_x9k3, bare = import_ms()
+    return {
+        "import_ms": round(with_x9k3 - bare, 1),
+        "interpreter_ms": round(bare, 1),
+        "construct_us": round(construct_us(), 1),
+        "vod_job_ms": round(job_ms(), 1),
+    }
+
+
+if __name__ == "__main__":
+    for name, value in startup().items():
+        print(f"{name}\t{value}")
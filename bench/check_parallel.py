@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""
+check_parallel.py
+
+Checks that --parallel output matches a serial parse,
+byte for byte, for generated streams that are hard to split.
+
+    * inputs too small to split, down to a few packets
+    * a first keyframe past the end of the first range
+    * a plain stream with in stream cues
+    * -S, with random access flags on only some IDR frames
+
+    python3 bench/check_parallel.py
+
+Exits 1 if any output differs.
+"""
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+WORKERS = [2, 4, 8]
+
+
+def write_late_keyframe(path, duration=30, gop=300):
+    """
+    write_late_keyframe writes a stream that starts
+    one second in, so the first keyframe is gop frames later.
+    """
+    from tsgen import TSGen  # pylint: disable=import-outside-toplevel
+
+    pats = 0
+    with open(path, "wb") as tsfile:
+        for pkt in TSGen(duration, 2000000, gop=gop).packets():
+            if pkt[1] & 0x1F == 0 and pkt[2] == 0:
+                pats += 1
+            if pats > 1:
+                tsfile.write(pkt)
+
+
+def write_sparse_rai(path, duration=30, gop=30):
+    """
+    write_sparse_rai writes a stream with an IDR frame every gop frames
+    and the random access flag on every third one of them,
+    so -S and the iframer find different keyframes.
+    """
+    from tsgen import TSGen  # pylint: disable=import-outside-toplevel
+
+    keys = 0
+    with open(path, "wb") as tsfile:
+        for pkt in TSGen(duration, 2000000, gop=gop).packets():
+            if pkt[3] & 0x20 and pkt[4] and pkt[5] & 0x40:
+                keys += 1
+                if keys % 3:
+                    pkt = pkt[:5] + bytes([pkt[5] & 0xBF]) + pkt[6:]
+            tsfile.write(pkt)
+
+
+def write_head(src, path, size):
+    """
+    write_head writes the first size bytes of src to path.
+    """
+    with open(src, "rb") as tsfile:
+        data = tsfile.read(size)
+    with open(path, "wb") as head:
+        head.write(data)
+
+
+def segment(ts_file, out_dir, extra=None):
+    """
+    segment runs x9k3 on ts_file.
+    """
+    from x9k3 import X9K3, argue  # pylint: disable=import-outside-toplevel
+
+    x9 = X9K3(args=argue(["-i", ts_file, "-o", out_dir] + (extra or [])))
+    x9.end_sleep = 0
+    x9.decode()
+
+
+def same(left, right):
+    """
+    same returns True if two output directories
+    have the same files with the same bytes.
+    """
+    cmp = filecmp.dircmp(left, right)
+    if cmp.left_only or cmp.right_only:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(
+        left, right, cmp.common_files, shallow=False
+    )
+    return not mismatch and not errors
+
+
+def main():
+    """
+    main checks each input with each worker count.
+    """
+    from tsgen import TSGen, mk_break_cues  # pylint: disable=import-outside-toplevel
+
+    sleep = time.sleep
+    time.sleep = lambda secs: None
+    failed = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cues_ts = os.path.join(work_dir, "cues.ts")
+        TSGen(20, 2000000, cues=mk_break_cues(5.0, 8.0, 2.0, 2)).write(cues_ts)
+        late_ts = os.path.join(work_dir, "late.ts")
+        write_late_keyframe(late_ts)
+        rai_ts = os.path.join(work_dir, "rai.ts")
+        write_sparse_rai(rai_ts)
+        inputs = {"cues": cues_ts, "late_keyframe": late_ts, "shulga": rai_ts}
+        flags = {"shulga": ["-S"]}
+        for size in [1000, 188 * 64, 188 * 4096]:
+            inputs[f"head_{size}"] = os.path.join(work_dir, f"head_{size}.ts")
+            write_head(cues_ts, inputs[f"head_{size}"], size)
+        try:
+            for name, ts_file in inputs.items():
+                serial = os.path.join(work_dir, f"{name}_serial")
+                segment(ts_file, serial, flags.get(name))
+                for workers in WORKERS:
+                    out_dir = os.path.join(work_dir, f"{name}_{workers}")
+                    try:
+                        segment(
+                            ts_file,
+                            out_dir,
+                            flags.get(name, []) + ["--parallel", str(workers)],
+                        )
+                        ok = same(serial, out_dir)
+                    except Exception as err:  # pylint: disable=broad-except
+                        print(f"{name} --parallel {workers}: {err!r}")
+                        ok = False
+                    print(f"{name} --parallel {workers}: {'ok' if ok else 'DIFF'}")
+                    if not ok:
+                        failed.append((name, workers))
+        finally:
+            time.sleep = sleep
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
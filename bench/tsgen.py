@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+"""
+tsgen.py
+
+Deterministic synthetic MPEG-TS streams for benchmarks.
+
+One h264 video pid with PCR and a keyframe every gop frames,
+optional extra (audio) pids, and SCTE-35 splice inserts
+on pid 0x86 with a matching sidecar file.
+
+    python3 bench/tsgen.py -o synth.ts -d 60 -b 2000000 -g 60 -p 2 --cues
+    python3 bench/tsgen.py -o synth.ts --sidecar sidecar.txt
+"""
+import argparse
+from threefive.crc import crc32
+from threefive.encode import mk_splice_insert
+
+PKT_SIZE = 188
+PAT_PID = 0x00
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+SCTE35_PID = 0x86
+FIRST_AUDIO_PID = 0x101
+
+
+class TSGen:
+    """
+    TSGen builds a deterministic MPEG-TS stream with one h264 video pid,
+    optional extra (audio) pids and SCTE-35 cues on pid 0x86.
+    """
+
+    def __init__(
+        self,
+        duration=60,
+        bitrate=2000000,
+        fps=30,
+        gop=60,
+        pids=1,
+        start_pts=10.0,
+        cues=None,
+    ):
+        self.duration = duration
+        self.bitrate = bitrate
+        self.fps = fps
+        self.gop = gop
+        self.audio_pids = [FIRST_AUDIO_PID + i for i in range(max(pids - 1, 0))]
+        self.start_pts = start_pts
+        self.cues = sorted(cues or [], key=lambda c: c[0])
+        self.cc = {}
+
+    def _cc(self, pid):
+        c_c = self.cc.get(pid, -1)
+        c_c = (c_c + 1) % 16
+        self.cc[pid] = c_c
+        return c_c
+
+    def _pkt(self, pid, payload, pusi=False, afield=None):
+        """
+        _pkt builds one 188 byte packet,
+        stuffing the adaptation field to fill it.
+        """
+        head = bytearray([0x47, pid >> 8, pid & 0xFF, 0x10 | self._cc(pid)])
+        if pusi:
+            head[1] |= 0x40
+        room = PKT_SIZE - 4 - len(payload)
+        if afield is not None or room > 0:
+            body = bytearray(afield or b"\x00")
+            if room > 0 or afield is not None:
+                need = room - 1 - len(body)
+                if need < 0:
+                    raise ValueError("payload too large")
+                body += b"\xff" * need
+            head[3] |= 0x20
+            head += bytes([len(body)]) + body
+        return bytes(head + payload)
+
+    @staticmethod
+    def _section(table_id, ext, body):
+        sec = bytearray([table_id, 0xB0, 0, ext >> 8, ext & 0xFF, 0xC1, 0, 0])
+        sec += body
+        length = len(sec) - 3 + 4
+        sec[1] = 0xB0 | (length >> 8)
+        sec[2] = length & 0xFF
+        sec += crc32(bytes(sec)).to_bytes(4, "big")
+        return bytes(sec)
+
+    def _psi_pkt(self, pid, section):
+        payload = b"\x00" + section
+        payload += b"\xff" * (184 - len(payload))
+        return self._pkt(pid, payload, pusi=True)
+
+    def pat(self):
+        """
+        pat returns a PAT packet
+        """
+        body = bytes([0, 1, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])
+        return self._psi_pkt(PAT_PID, self._section(0x00, 1, body))
+
+    def pmt(self):
+        """
+        pmt returns a PMT packet
+        """
+        body = bytearray([0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0])
+        streams = [(0x1B, VIDEO_PID)]
+        streams += [(0x0F, pid) for pid in self.audio_pids]
+        streams.append((0x86, SCTE35_PID))
+        for stype, pid in streams:
+            body += bytes([stype, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, 0])
+        return self._psi_pkt(PMT_PID, self._section(0x02, 1, bytes(body)))
+
+    @staticmethod
+    def _pts_bytes(pts, marker=0x21):
+        ticks = int(round(pts * 90000)) & 0x1FFFFFFFF
+        return bytes(
+            [
+                marker | ((ticks >> 29) & 0x0E),
+                (ticks >> 22) & 0xFF,
+                ((ticks >> 14) & 0xFE) | 1,
+                (ticks >> 7) & 0xFF,
+                ((ticks << 1) & 0xFE) | 1,
+            ]
+        )
+
+    @staticmethod
+    def _pcr_bytes(pts):
+        base = int(round(pts * 90000)) & 0x1FFFFFFFF
+        return bytes(
+            [
+                (base >> 25) & 0xFF,
+                (base >> 17) & 0xFF,
+                (base >> 9) & 0xFF,
+                (base >> 1) & 0xFF,
+                ((base & 1) << 7) | 0x7E,
+                0,
+            ]
+        )
+
+    def _pes(self, pid, stream_id, pts, data, key=False, pcr=False):
+        """
+        _pes splits one PES packet into ts packets.
+        """
+        pes = b"\x00\x00\x01" + bytes([stream_id, 0, 0, 0x80, 0x80, 5])
+        pes += self._pts_bytes(pts) + data
+        pkts = []
+        first = True
+        while pes:
+            afield = None
+            if first and (pcr or key):
+                flags = 0x10 if pcr else 0
+                flags |= 0x40 if key else 0
+                afield = bytes([flags]) + (self._pcr_bytes(pts) if pcr else b"")
+            room = 184 - (len(afield) + 1 if afield is not None else 0)
+            chunk, pes = pes[:room], pes[room:]
+            pkts.append(self._pkt(pid, chunk, pusi=first, afield=afield))
+            first = False
+        return pkts
+
+    def _cue_pkt(self, cue):
+        section = cue.bites
+        return self._psi_pkt(SCTE35_PID, section)
+
+    def packets(self):
+        """
+        packets yields every packet of the stream
+        """
+        frame_size = max(int(self.bitrate / 8 / self.fps) - 14, 8)
+        frames = int(self.duration * self.fps)
+        cues = list(self.cues)
+        for frame in range(frames):
+            pts = self.start_pts + frame / self.fps
+            if frame % self.fps == 0:
+                yield self.pat()
+                yield self.pmt()
+            while cues and cues[0][0] - 4.0 <= pts:
+                yield self._cue_pkt(cues.pop(0)[1])
+            key = frame % self.gop == 0
+            nal = b"\x00\x00\x00\x01" + (b"\x65" if key else b"\x41")
+            data = nal + bytes((frame + i) & 0x3F for i in range(frame_size - 5))
+            yield from self._pes(VIDEO_PID, 0xE0, pts, data, key=key, pcr=True)
+            for apid in self.audio_pids:
+                yield from self._pes(apid, 0xC0, pts, b"\xff\xf1" + b"\x00" * 120)
+
+    def write(self, path):
+        """
+        write writes the stream to path
+        """
+        with open(path, "wb") as tsfile:
+            for pkt in self.packets():
+                tsfile.write(pkt)
+
+
+def mk_break_cues(start, every, duration, count, event_id=1):
+    """
+    mk_break_cues returns (pts, Cue) pairs
+    for count ad breaks of duration seconds.
+    """
+    cues = []
+    for i in range(count):
+        out_pts = round(start + i * every, 6)
+        in_pts = round(out_pts + duration, 6)
+        out_cue = mk_splice_insert(event_id + 2 * i, out_pts, duration, True)
+        in_cue = mk_splice_insert(event_id + 2 * i + 1, in_pts, None, False)
+        cues.append((out_pts, out_cue))
+        cues.append((in_pts, in_cue))
+    return cues
+
+
+def write_sidecar(path, cues):
+    """
+    write_sidecar writes (pts, cue) pairs as a sidecar file.
+    """
+    with open(path, "w", encoding="utf8") as sidecar:
+        for pts, cue in cues:
+            sidecar.write(f"{pts}, {cue.encode()}\n")
+
+
+def argue():
+    """
+    argue parse command line args
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default="synth.ts", help="Output file")
+    parser.add_argument(
+        "-d", "--duration", type=float, default=60, help="Seconds [default:60]"
+    )
+    parser.add_argument(
+        "-b", "--bitrate", type=int, default=2000000, help="Video bitrate [default:2000000]"
+    )
+    parser.add_argument(
+        "-g", "--gop", type=int, default=60, help="Frames per GOP [default:60]"
+    )
+    parser.add_argument(
+        "-p", "--pids", type=int, default=2, help="Number of A/V pids [default:2]"
+    )
+    parser.add_argument(
+        "--cues",
+        action="store_const",
+        default=False,
+        const=True,
+        help="Flag to add SCTE-35 cues on pid 0x86 [default:False]",
+    )
+    parser.add_argument(
+        "--sidecar", default=None, help="Write the cues to a sidecar file [default:None]"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = argue()
+    cues = []
+    if args.cues or args.sidecar:
+        cues = mk_break_cues(20.0, 30.0, 10.0, int(args.duration // 30))
+    TSGen(
+        args.duration,
+        args.bitrate,
+        gop=args.gop,
+        pids=args.pids,
+        cues=cues if args.cues else None,
+    ).write(args.output)
+    if args.sidecar:
+        write_sidecar(args.sidecar, cues)
@@ -15,8 +15,8 @@ setuptools.setup(
     long_description=readme,
     long_description_content_type="text/markdown",
     url="https://github.com/futzu/x9k3",
-    py_modules=["x9k3"],
-    scripts=["bin/x9k3"],
+    py_modules=["x9k3", "x13mp", "x9k3d", "x9k3b"],
+    scripts=["bin/x9k3", "bin/x13mp", "bin/x9k3d", "bin/x9k3b"],
     platforms="all",
     install_requires=[
         "threefive >= 2.4.9",
@@ -24,6 +24,9 @@ setuptools.setup(
         "iframes >= 0.0.7",
         "m3ufu >= 0.0.83",
     ],
+    extras_require={
+        "batch": ["numpy"],
+    },
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
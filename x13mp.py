@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+"""
+x13mp
+
+Adaptive Bit Rate HLS with x9k3.
+
+x13mp takes a master.m3u8, runs one X9K3 process per variant,
+and writes a new master.m3u8 pointing at the per variant output dirs.
+All variants splice on one shared cue schedule.
+"""
+
+import copy
+import multiprocessing as mp
+import os
+import queue
+import time
+from threefive import print2
+import threefive.stream as strm
+from new_reader import reader
+from x9k3 import X9K3, SidecarWatcher, argue
+
+
+REPORT_SECS = 10
+POLL_SECS = 0.5
+# media seconds between cue clock updates from the cue source
+CLOCK_SECS = 0.5
+
+
+class Variant:
+    """
+    Variant holds a variant uri from the master.m3u8,
+    it's #EXT-X-STREAM-INF line, and it's worker stats.
+    """
+
+    def __init__(self, idx, uri, stream_inf):
+        self.idx = idx
+        self.uri = uri
+        self.stream_inf = stream_inf
+        self.out_dir = None
+        self.process = None
+        self.cue_q = None
+        self.up = None
+        self.down = None
+        self.error = None
+        self.segments = 0
+        self.bytes = 0
+        self.media_secs = 0.0
+        self.last_seen = None
+
+    def throughput(self, now):
+        """
+        throughput returns bits per second of segments written,
+        and media seconds segmented per wall clock second.
+        """
+        if not self.up:
+            return 0.0, 0.0
+        wall = max((self.down or now) - self.up, 0.001)
+        return self.bytes * 8 / wall, self.media_secs / wall
+
+    def health(self, now):
+        """
+        health returns up, down, stalled or failed.
+        """
+        if self.error:
+            return "failed"
+        if self.process and not self.process.is_alive():
+            return "down"
+        if self.last_seen and now - self.last_seen > REPORT_SECS * 3:
+            return "stalled"
+        return "up"
+
+
+class VariantX9K3(X9K3):
+    """
+    VariantX9K3 is X9K3 for one variant.
+
+    Cues come only from the shared schedule on cue_q.
+    The cue source variant resolves splice immediate
+    and in stream SCTE-35 cues to a pts and sends them
+    to x13mp to be broadcast to the other variants.
+
+    The cue source also sends it's pts, the cue clock, as it parses.
+    x13mp puts the clock on cue_q after the cues,
+    and the other variants wait for the clock to reach their pts,
+    so they can't cut past a cue before they have it.
+    """
+
+    def __init__(self, idx, cue_q, events, cue_source=False):
+        super().__init__()
+        self.idx = idx
+        self.cue_q = cue_q
+        self.events = events
+        self.cue_source = cue_source
+        self.passes = 0
+        self.clock = (-1, 0.0)
+
+    def _held(self):
+        """
+        _held returns True while the cue clock
+        is behind this variant's pts.
+        """
+        if self.cue_source or self.now is None:
+            return False
+        return self.clock < (self.passes, self.now)
+
+    def _send_clock(self):
+        if self.now is None:
+            return
+        if self.clock[0] != self.passes or abs(self.now - self.clock[1]) >= CLOCK_SECS:
+            self.clock = (self.passes, self.now)
+            self.events.put(("clock", self.idx, self.clock))
+
+    def _load_sidecar(self):
+        """
+        _load_sidecar loads cues from the shared schedule,
+        waiting on the cue clock when it's behind.
+        """
+        if self.cue_source:
+            self._send_clock()
+        while True:
+            try:
+                if self._held():
+                    line = self.cue_q.get()
+                else:
+                    line = self.cue_q.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(line, tuple):
+                self.clock = line
+                continue
+            if float(line.split(",", 1)[0]) == 0.0:
+                if self.cue_source and self.args.live:
+                    line = f'{self.now},{line.split(",", 1)[1]}'
+                    self.add2sidecar(line)
+                    self.events.put(("cue", line))
+                continue
+            self.add2sidecar(line)
+
+    def decode(self, func=False):
+        """
+        decode parses the variant, the cue source
+        ends each pass with an infinite cue clock.
+        """
+        super().decode(func)
+        if self.cue_source:
+            self.clock = (self.passes, float("inf"))
+            self.events.put(("clock", self.idx, self.clock))
+
+    def add2sidecar(self, line):
+        """
+        add2sidecar adds insert_pts,cue to the cue schedule,
+        and reports a cue that is already behind this variant.
+        """
+        if self.started and float(line.split(",", 1)[0]) < self.started:
+            print2(f"late cue: {line} is before {self.started}")
+            self.events.put(("late", self.idx, line))
+        super().add2sidecar(line)
+
+    def _parse_scte35(self, pkt, pid):
+        """
+        _parse_scte35 parses SCTE-35 cues without splicing on them,
+        the cue source sends them to x13mp.
+        """
+        cue = strm.Stream._parse_scte35(self, pkt, pid)
+        if cue and self.cue_source:
+            cue.decode()
+            line = f"{self.adjusted_pts(cue, pid)}, {cue.encode()}"
+            self.add2sidecar(line)
+            self.events.put(("cue", line))
+        return cue
+
+    def _write_segment(self):
+        nbytes = self.active_segment.tell()
+        segnum = self.segnum or 0
+        super()._write_segment()
+        if self.segnum is not None and self.segnum != segnum:
+            seg_time = float(self.window.panes[-1].tags["#EXTINF"].rstrip(","))
+            self.events.put(("segment", self.idx, self.segnum - 1, seg_time, nbytes))
+
+    def _replay_segment(self, kept, nbytes, start, seg_time, tags):
+        super()._replay_segment(kept, nbytes, start, seg_time, tags)
+        self.events.put(("segment", self.idx, self.segnum - 1, seg_time, nbytes))
+
+
+def run_variant(idx, args, cue_q, events, cue_source):
+    """
+    run_variant segments one variant,
+    it is the target of each worker process.
+    """
+    events.put(("up", idx, time.time()))
+    try:
+        x9 = VariantX9K3(idx, cue_q, events, cue_source)
+        x9.args = args
+        x9.decode()
+        while args.replay:
+            if not x9.replay_cached():
+                last = x9
+                x9 = VariantX9K3(idx, cue_q, events, cue_source)
+                x9.args = args
+                x9.passes = last.passes + 1
+                x9.clock = last.clock
+                x9.follow(last)
+                x9.continue_m3u8()
+                x9.decode()
+    except Exception as err:  # pylint: disable=broad-except
+        events.put(("error", idx, repr(err)))
+        raise
+    finally:
+        events.put(("down", idx, time.time()))
+
+
+class X13MP:
+    """
+    X13MP runs a X9K3 worker process per variant
+    of a master.m3u8.
+    """
+
+    def __init__(self, args=None):
+        self.args = args or argue()
+        self.master = self.args.input
+        self.headers = []
+        self.variants = []
+        self.events = mp.Queue()
+        self.watcher = None
+        self.last_report = 0
+
+    @staticmethod
+    def _clean_line(line):
+        return X9K3._clean_line(line).strip()
+
+    def _resolve(self, uri):
+        if "://" in uri or uri.startswith("/"):
+            return uri
+        based = self.master.rsplit("/", 1)
+        if len(based) > 1:
+            return f"{based[0]}/{uri}"
+        return uri
+
+    def load_master(self):
+        """
+        load_master reads the master.m3u8 variants.
+        """
+        with reader(self.master) as master:
+            lines = [self._clean_line(line) for line in master.readlines()]
+        stream_inf = None
+        for line in lines:
+            if not line:
+                continue
+            if line.startswith("#EXT-X-STREAM-INF"):
+                stream_inf = line
+            elif line.startswith("#"):
+                if not self.variants and stream_inf is None:
+                    self.headers.append(line)
+            elif stream_inf:
+                idx = len(self.variants)
+                self.variants.append(Variant(idx, self._resolve(line), stream_inf))
+                stream_inf = None
+        if not self.variants:
+            raise ValueError(f"{self.master} has no #EXT-X-STREAM-INF variants")
+
+    def write_master(self):
+        """
+        write_master writes a master.m3u8 in output_dir
+        pointing to the per variant index.m3u8 files.
+        """
+        lines = self.headers[:]
+        for variant in self.variants:
+            lines.append(variant.stream_inf)
+            lines.append(f"{variant.idx}/index.m3u8")
+        master = X9K3.mk_uri(self.args.output_dir, "master.m3u8")
+        with open(f"{master}.tmp", "w", encoding="utf8") as m3u8:
+            m3u8.write("\n".join(lines) + "\n")
+        os.replace(f"{master}.tmp", master)
+
+    def _variant_args(self, variant):
+        args = copy.copy(self.args)
+        args.input = variant.uri
+        args.output_dir = variant.out_dir
+        args.sidecar_file = None
+        return args
+
+    def start(self):
+        """
+        start starts a worker process per variant.
+        The first variant is the cue source.
+        """
+        for variant in self.variants:
+            variant.out_dir = X9K3.mk_uri(self.args.output_dir, str(variant.idx))
+            os.makedirs(variant.out_dir, exist_ok=True)
+            variant.cue_q = mp.Queue()
+        self.write_master()
+        self.poll_sidecar()
+        for variant in self.variants:
+            variant.process = mp.Process(
+                target=run_variant,
+                args=(
+                    variant.idx,
+                    self._variant_args(variant),
+                    variant.cue_q,
+                    self.events,
+                    variant.idx == 0,
+                ),
+                name=f"Process-{variant.idx + 1}",
+            )
+            variant.process.start()
+
+    def broadcast(self, line, start=0):
+        """
+        broadcast sends a (pts, cue) line, or a cue clock,
+        to every variant from variants[start] on.
+        """
+        for variant in self.variants[start:]:
+            variant.cue_q.put(line)
+
+    def poll_sidecar(self):
+        """
+        poll_sidecar broadcasts new sidecar lines.
+        splice immediate lines go to the cue source
+        to be resolved to a pts first.
+        """
+        if not self.args.sidecar_file:
+            return
+        if not self.watcher:
+            self.watcher = SidecarWatcher(self.args.sidecar_file)
+            self.watcher.interval = self.args.sidecar_interval or POLL_SECS
+        if not self.watcher.due():
+            return
+        for line in self.watcher.poll():
+            line = line.decode().strip().split("#", 1)[0]
+            if not line:
+                continue
+            if float(line.split(",", 1)[0]) == 0.0:
+                self.variants[0].cue_q.put(line)
+            else:
+                self.broadcast(line)
+
+    def _event(self, event):
+        kind = event[0]
+        if kind == "cue":
+            print2(f"x13mp cue: {event[1]}")
+            self.broadcast(event[1], start=1)
+            return
+        variant = self.variants[event[1]]
+        variant.last_seen = time.time()
+        if kind == "up":
+            variant.up = event[2]
+            print2(f"{variant.process.name}  is up")
+        if kind == "clock":
+            self.broadcast(event[2], start=1)
+        if kind == "late":
+            print2(f"{variant.process.name}  late cue: {event[2]}")
+        if kind == "segment":
+            variant.segments += 1
+            variant.media_secs += event[3]
+            variant.bytes += event[4]
+        if kind == "error":
+            variant.error = event[2]
+            print2(f"{variant.process.name}  failed: {variant.error}")
+        if kind == "down":
+            variant.down = event[2]
+            print2(f"{variant.process.name}  is down")
+            if variant.idx == 0:
+                self.broadcast((float("inf"), float("inf")), start=1)
+
+    def report(self):
+        """
+        report prints health and throughput for each variant.
+        """
+        now = time.time()
+        for variant in self.variants:
+            bps, speed = variant.throughput(now)
+            print2(
+                f"{variant.process.name}  {variant.health(now)}"
+                f"   segments: {variant.segments}"
+                f"   {bps / 1000000:.3f} Mbps   {speed:.2f}x realtime"
+            )
+        self.last_report = now
+
+    def running(self):
+        """
+        running returns True if any worker is alive.
+        """
+        return any(variant.process.is_alive() for variant in self.variants)
+
+    def _drain(self):
+        deadline = time.time() + POLL_SECS
+        while True:
+            try:
+                self._event(self.events.get(timeout=max(deadline - time.time(), 0)))
+            except queue.Empty:
+                return
+            if time.time() >= deadline:
+                return
+
+    def _chk_cue_source(self):
+        """
+        _chk_cue_source releases the other variants
+        if the cue source died without a down event.
+        """
+        source = self.variants[0]
+        if source.down is None and not source.process.is_alive():
+            source.down = time.time()
+            self.broadcast((float("inf"), float("inf")), start=1)
+
+    def run(self):
+        """
+        run runs the variants until they all shut down.
+        """
+        self.load_master()
+        self.start()
+        self.last_report = time.time()
+        try:
+            while self.running():
+                self._drain()
+                self._chk_cue_source()
+                self.poll_sidecar()
+                if time.time() - self.last_report >= REPORT_SECS:
+                    self.report()
+        except KeyboardInterrupt:
+            for variant in self.variants:
+                variant.process.terminate()
+        for variant in self.variants:
+            variant.process.join()
+        self._drain()
+        self.report()
+
+
+def cli():
+    """
+    cli runs x13mp with the x9k3 command line args.
+    -i is the master.m3u8.
+
+     from x13mp import cli
+     cli()
+    """
+    X13MP().run()
+
+
+if __name__ == "__main__":
+    cli()
@@ -3,25 +3,58 @@
 """
 X9K3
 """
-import argparse
 import datetime
+import heapq
 import io
+import json
+import mmap
 import os
+import re
+import shutil
+import struct
 import sys
+import threading
 import time
+import urllib.error
+from bisect import bisect_left, bisect_right
 from collections import deque
-from operator import itemgetter
 from new_reader import reader
 from iframes import IFramer
 from threefive import Cue, print2
 import threefive.stream as strm
-from m3ufu import M3uFu
 
+# numpy is imported by _numpy when batch scanning first needs it.
+np = None
+NUMPY_TRIED = False
 
 MAJOR = "0"
 MINOR = "2"
 MAINTAINENCE = "27"
 
+PKT_SIZE = 188
+BATCH_PKTS = 1024
+# LL-HLS parts are listed for this many of the newest segments
+PART_SEGMENTS = 2
+# replay keeps the first pass segments in this directory of output_dir
+REPLAY_DIR = ".x9k3-replay"
+
+
+def _numpy():
+    """
+    _numpy imports numpy the first time it is called,
+    returns None if numpy is not installed.
+    """
+    global np, NUMPY_TRIED  # pylint: disable=global-statement
+    if not NUMPY_TRIED:
+        NUMPY_TRIED = True
+        try:
+            import numpy  # pylint: disable=import-outside-toplevel
+
+            np = numpy
+        except ImportError:
+            np = None
+    return np
+
 
 def version():
     """
@@ -36,28 +69,62 @@ class X9K3(strm.Stream):
     X9K3 class
     """
 
-    def __init__(self, tsdata=None, show_null=False):
+    # header and LL-HLS tags not kept by _reload_byteranges
+    RELOAD_SKIP = {
+        "#EXTM3U", "#EXT-X-VERSION", "#EXT-X-TARGETDURATION",
+        "#EXT-X-X9K3-VERSION", "#EXT-X-SERVER-CONTROL", "#EXT-X-PART-INF",
+        "#EXT-X-PART", "#EXT-X-PRELOAD-HINT", "#EXT-X-ENDLIST",
+    }  # fmt: skip
+
+    def __init__(self, tsdata=None, show_null=False, args=None):
         super().__init__(tsdata, show_null)
         self._tsdata = tsdata
         self.in_stream = tsdata
-        self.active_segment = io.BytesIO()
+        self.buffers = SegmentBuffers()
+        self.active_segment = self.buffers.new()
         self.iframer = IFramer(shush=True)
         self.scte35 = SCTE35()
-        self.sidecar = deque()
+        self.sidecar = CueSchedule()
         self.timer = Timer()
         self.m3u8 = "index.m3u8"
         self.window = SlidingWindow()
+        self.writer = SegmentWriter()
+        self.reaper = Reaper()
+        self.window.unlink = self.reaper.add
+        self.writer.unlink = self.reaper.add
+        self.metrics = None
+        self.checkpoint = None
+        self.origin = None
         self.segnum = None
-        self.args = argue()
+        self.args = args if args is not None else Config()
         self.started = None
         self.next_start = None
         self.media_seq = 0
         self.discontinuity_sequence = 0
         self.first_segment = True
-        self.media_list = deque()
+        self.media_list = MediaHistory()
+        self.poller = None
         self.now = None
-        self.last_sidelines = ""
+        self.sidecar_watcher = None
         self.rollover_duration_pad = 0
+        self.parts = []
+        self.part_names = []
+        self.part_start = None
+        self.part_offset = 0
+        self.last_pes = None
+        self.part_chunks = deque()
+        self.stale_parts = deque()
+        self.media_file = None
+        self.media_offset = 0
+        self.media_secs = 0
+        self.pts_index = None
+        self.bytes_done = 0
+        self.index_cache = None
+        self.cached = None
+        self.scan = None
+        self.kept = None
+        self.continued = False
+        self.end_sleep = 0.5
 
     def _args_version(self):
         if self.args.version:
@@ -65,6 +132,8 @@ class X9K3(strm.Stream):
             sys.exit()
 
     def _args_input(self):
+        if self.args.input is None:
+            self.args.input = sys.stdin.buffer
         self.in_stream = self.args.input
         if self._tsdata is not None:
             self.args.input = self._tsdata
@@ -105,13 +174,157 @@ class X9K3(strm.Stream):
 
         flags.popleft()  # pop self.args.replay
 
+    def _args_part_time(self):
+        if self.args.part_time:
+            if self.args.part_time >= self.args.time:
+                raise ValueError("part time must be less than segment time")
+            self.args.live = True
+
+    def _args_byterange(self):
+        if self.args.byterange:
+            if self.args.serve_port is not None:
+                raise ValueError("byterange can not be used with serve_port")
+            if self.args.byterange <= 0:
+                raise ValueError("byterange minutes must be more than 0")
+
+    def _args_replay(self):
+        if self.args.replay and not (self.args.part_time or self.args.byterange):
+            self.kept = []
+
+    def _args_parallel(self):
+        if not self.args.parallel:
+            return
+        if self.args.live or not (
+            isinstance(self.args.input, str)
+            and os.path.isfile(self.args.input)
+            and "m3u8" not in self.args.input
+        ):
+            raise ValueError("parallel needs a local file input, and no live flags")
+
+    def _args_index_cache(self):
+        if self.args.index_cache is None:
+            return
+        if self.args.live or not (
+            isinstance(self.args.input, str)
+            and os.path.isfile(self.args.input)
+            and "m3u8" not in self.args.input
+        ):
+            raise ValueError("index cache needs a local file input, and no live flags")
+        self.index_cache = IndexCache(
+            self.args.index_cache, self.args.input, self.args.shulga
+        )
+        self.cached = self.index_cache.load()
+        if self.cached is None:
+            self.scan = {"start": None, "keyframes": [], "cues": []}
+
     def _args_window_size(self):
         if self.args.live:
             self.window.size = self.args.window_size
+            self.timer.max_late = self.args.time * 3
+
+    def _args_segment_buffer(self):
+        if self.args.segment_buffer not in SegmentBuffers.MODES:
+            raise ValueError(f"segment buffer must be in {SegmentBuffers.MODES}")
+        self.buffers.mode = self.args.segment_buffer
+        self.buffers.tmp_dir = self.args.output_dir
+        self.buffers.discard(self.active_segment)
+        self.active_segment = self.buffers.new()
+
+    def _args_mmap(self):
+        if not self.args.mmap:
+            return
+        if not (
+            isinstance(self.args.input, str)
+            and os.path.isfile(self.args.input)
+            and "m3u8" not in self.args.input
+        ):
+            raise ValueError("mmap needs a local file input")
+        with open(self.args.input, "rb") as media:
+            self.buffers.mapping = mmap.mmap(media.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffers.discard(self.active_segment)
+        self.active_segment = self.buffers.new()
+
+    def _args_reaper(self):
+        grace = self.args.delete_grace
+        if grace is None:
+            grace = (self.window.size + 1) * self.args.time
+        self.reaper.grace = grace
+        if self.window.delete:
+            self.reaper.start()
+
+    def _args_writer(self):
+        self.writer.maxsize = self.args.writer_queue
+        if self.args.writer_policy not in SegmentWriter.POLICIES:
+            raise ValueError(f"writer policy must be in {SegmentWriter.POLICIES}")
+        self.writer.policy = self.args.writer_policy
+        if self.writer.maxsize > 0:
+            self.writer.start()
+            self.window.unlink = self.writer.remove
+
+    def _args_serve(self):
+        if self.args.serve_port is None:
+            if self.args.no_disk:
+                raise ValueError("no_disk needs serve_port")
+            return
+        if self.args.no_disk and self.args.continue_m3u8:
+            raise ValueError("no_disk can't continue_m3u8, index.m3u8 is only in memory")
+        if self.writer.store is None:
+            self.writer.store = MemoryStore()
+        self.writer.store.linger = self.window.size
+        self.writer.disk = not self.args.no_disk
+        if self.args.no_disk:
+            self.window.delete = False
+        self.window.evict = self.writer.retire
+        self.origin = OriginServer(
+            self.writer.store, self.args.serve_host, self.args.serve_port
+        )
+        self.origin.hold = self.args.time * 3
+        self.origin.start()
+
+    def _args_metrics(self):
+        if self.args.metrics_port is None and self.args.stats_file is None:
+            return
+        self.metrics = Metrics(self)
+        self.metrics.instrument()
+        self.metrics.stats_file = self.args.stats_file
+        if self.args.metrics_port is not None:
+            self.metrics.serve(self.args.metrics_port)
 
     def _args_continue_m3u8(self):
         if self.args.continue_m3u8:
             self.continue_m3u8()
+            self._reap_orphans()
+
+    def _reap_orphans(self):
+        """
+        _reap_orphans cleans up seg*.ts and media*.ts files left
+        in output_dir by a crash, that aren't in the continued window.
+        Ones numbered from segnum on, temp files, and segment buffers
+        of other processes are deleted right away,
+        before they're written again.
+        Older ones are given to the reaper when deleting.
+        """
+        listed = {MemoryStore.key(pane.name) for pane in self.window.panes}
+        for seg_file in sorted(os.listdir(self.args.output_dir)):
+            seg_name = self.mk_uri(self.args.output_dir, seg_file)
+            buffer = Reaper.BUFFER.match(seg_file)
+            if buffer and int(buffer.group(1)) != os.getpid():
+                print2(f"deleting orphan {seg_name}")
+                os.unlink(seg_name)
+                continue
+            match = Reaper.ORPHAN.match(seg_file)
+            if not match or seg_file in listed:
+                continue
+            if match.group(3) or int(match.group(1)) >= self.segnum:
+                print2(f"deleting orphan {seg_name}")
+                os.unlink(seg_name)
+            elif self.window.delete:
+                self.reaper.add(seg_name)
+
+    def _args_pts_index(self):
+        if self.args.pts_index:
+            self.pts_index = PtsIndex(f"{self.m3u8uri()}.idx")
+            self.pts_index.open(self.segnum or 0, append=self.continued)
 
     def apply_args(self):
         """
@@ -122,11 +335,23 @@ class X9K3(strm.Stream):
         self._args_input()
         self._args_hls_tag()
         self._args_output_dir()
+        self._args_segment_buffer()
+        self._args_mmap()
         self._args_flags()
+        self._args_part_time()
+        self._args_byterange()
+        self._args_replay()
+        self._args_index_cache()
+        self._args_parallel()
         self._args_window_size()
+        self._args_reaper()
+        self._args_writer()
+        self._args_serve()
+        self._args_metrics()
         self._args_continue_m3u8()
+        self._args_pts_index()
 
-        if isinstance(self._tsdata, str):
+        if isinstance(self._tsdata, str) and not self.args.mmap:
             self._tsdata = reader(self._tsdata)
 
     def _reload_chunk(self, segment):
@@ -142,6 +367,49 @@ class X9K3(strm.Stream):
         chunk.tags = segment.tags
         self.window.slide_panes(chunk)
 
+    def _reload_byteranges(self):
+        """
+        _reload_byteranges loads a byterange index.m3u8
+        into the SlidingWindow. m3ufu can't be used,
+        it lists each media file only once.
+        """
+        tags = {}
+        num = 0
+        for line in self._m3u8_lines():
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith("#"):
+                chunk = Chunk(line, self.mk_uri(self.args.output_dir, line), num)
+                chunk.tags = tags
+                self.window.slide_panes(chunk)
+                tags = {}
+                num += 1
+                continue
+            kay, colon, vee = line.partition(":")
+            if kay == "#EXT-X-MEDIA-SEQUENCE":
+                num = int(vee)
+            elif kay == "#EXT-X-DISCONTINUITY-SEQUENCE":
+                self.discontinuity_sequence = int(vee)
+            elif kay not in self.RELOAD_SKIP:
+                tags[kay] = vee if colon else None
+        self.segnum = self.window.panes[-1].num + 1
+        if self.args.live or self.args.continue_m3u8:
+            self.window.slide_panes()
+
+    def _m3u8_lines(self):
+        """
+        _m3u8_lines returns the lines of the index.m3u8 to continue,
+        read from the MemoryStore with --no_disk.
+        """
+        if not self.args.no_disk:
+            with open(self.m3u8uri(), "r", encoding="utf8") as m3u8:
+                return m3u8.readlines()
+        data = self.writer.store.get(self.m3u8) if self.writer.store else None
+        if data is None:
+            raise ValueError(f"no {self.m3u8} in memory to continue")
+        return data.decode().splitlines(True)
+
     def reload_m3u8(self):
         """
         m3u8_reload is called when the continue_m3u8 option is set.
@@ -150,12 +418,16 @@ class X9K3(strm.Stream):
         An M3uFu instance parses tmp.m3u8 and loads the data into
         the SlidingWindow, X9K3.window.
         """
+        if self.args.byterange:
+            self._reload_byteranges()
+            return
+        from m3ufu import M3uFu  # pylint: disable=import-outside-toplevel
+
         m3 = M3uFu()
         tmp_name = self.mk_uri(self.args.output_dir, "tmp.m3u8")
         with open(tmp_name, "w", encoding="utf8") as tmp_m3u8:
-            with open(self.m3u8uri(), "r", encoding="utf8") as m3u8:
-                tmp_m3u8.write("\n".join(m3u8.readlines()))
-                tmp_m3u8.write("\n#EXT-X-ENDLIST\n")
+            tmp_m3u8.write("\n".join(self._m3u8_lines()))
+            tmp_m3u8.write("\n#EXT-X-ENDLIST\n")
         m3.m3u8 = tmp_name
         m3.decode()
         # print(m3.headers)
@@ -168,13 +440,77 @@ class X9K3(strm.Stream):
             self.window.slide_panes()
         os.unlink(tmp_name)
 
+    def _state(self):
+        """
+        _state returns the state saved in a Checkpoint.
+        """
+        cue = self.scte35.cue
+        return {
+            "version": version(),
+            "segnum": self.segnum,
+            "media_seq": self.media_seq,
+            "discontinuity_sequence": self.discontinuity_sequence,
+            "scte35": {
+                "cue": cue.encode() if cue else None,
+                "cue_state": self.scte35.cue_state,
+                "cue_time": self.scte35.cue_time,
+                "break_timer": self.scte35.break_timer,
+                "break_duration": self.scte35.break_duration,
+                "event_id": self.scte35.event_id,
+                "seg_type": self.scte35.seg_type,
+            },
+            "sidecar": list(self.sidecar),
+        }
+
+    def _write_checkpoint(self):
+        if self.args.checkpoint:
+            if not self.checkpoint:
+                self.checkpoint = Checkpoint(self.m3u8uri())
+            self.writer.write_checkpoint(
+                self.checkpoint, self._state(), list(self.window.panes), self.window.size
+            )
+
+    def resume(self):
+        """
+        resume loads the window, sequence numbers,
+        SCTE35 cue state and pending sidecar cues
+        from a Checkpoint.
+        The window size is set first, resume can run
+        before apply_args when --replay parses the input again.
+        """
+        self._args_window_size()
+        state, panes = self.checkpoint.load(self.window.size)
+        for chunk in panes:
+            self.window.slide_panes(chunk)
+        self.segnum = state["segnum"]
+        self.media_seq = state["media_seq"]
+        self.discontinuity_sequence = state["discontinuity_sequence"]
+        cue_state = state["scte35"]
+        for attr, value in cue_state.items():
+            setattr(self.scte35, attr, value)
+        if cue_state["cue"]:
+            self.scte35.cue = Cue(cue_state["cue"])
+            self.scte35.cue.decode()
+        for insert_pts, cue in state["sidecar"]:
+            self.sidecar.add(insert_pts, cue)
+        if self.args.live or self.args.continue_m3u8:
+            self.window.slide_panes()
+
     def continue_m3u8(self):
         """
         continue_m3u8 reads self.discontinuity_sequence
         and self.segnum from an existing index.m3u8
         when the self.args.continue_m3u8 flag is set.
+        With self.args.checkpoint set, a saved Checkpoint
+        is loaded instead when there is one.
         """
-        self.reload_m3u8()
+        if self.args.checkpoint:
+            self.checkpoint = Checkpoint(self.m3u8uri())
+        if self.checkpoint and self.checkpoint.exists():
+            self.resume()
+        else:
+            self.reload_m3u8()
+        self.continued = True
         print2(f"Continuing {self.m3u8uri()} @ segment number {self.segnum}")
 
     def m3u8uri(self):
@@ -202,11 +538,20 @@ class X9K3(strm.Stream):
         """
         m3u = "#EXTM3U"
         m3u_version = "#EXT-X-VERSION:3"
+        if self.args.byterange:
+            m3u_version = "#EXT-X-VERSION:4"
         target = f"#EXT-X-TARGETDURATION:{int(self.args.time+1)}"
         seq = f"#EXT-X-MEDIA-SEQUENCE:{self.media_seq}"
         dseq = f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}"
         x9k3v = f"#EXT-X-X9K3-VERSION:{version()}"
         bumper = ""
+        ll_hls = []
+        if self.args.part_time:
+            hold_back = self.args.part_time * 3
+            ll_hls = [
+                f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={hold_back:.6f}",
+                f"#EXT-X-PART-INF:PART-TARGET={self.args.part_time:.6f}",
+            ]
         return "\n".join(
             [
                 m3u,
@@ -214,6 +559,9 @@ class X9K3(strm.Stream):
                 target,
                 seq,
                 dseq,
+            ]
+            + ll_hls
+            + [
                 x9k3v,
                 bumper,
             ]
@@ -253,6 +601,24 @@ class X9K3(strm.Stream):
             chunk.add_tag("#Iframe", f" @ {self.started}")
             chunk.add_tag("#EXT-X-PROGRAM-DATE-TIME", f"{iso8601}")
 
+    @staticmethod
+    def _chk_daterange(chunk):
+        """
+        _chk_daterange re-dates the START-DATE or END-DATE
+        of a replayed #EXT-X-DATERANGE tag to now.
+        """
+        daterange = chunk.tags.get("#EXT-X-DATERANGE")
+        if daterange:
+            iso8601 = f"{datetime.datetime.utcnow().isoformat()}Z"
+            chunk.add_tag(
+                "#EXT-X-DATERANGE",
+                re.sub(
+                    r'((?:START|END)-DATE)="[^"]*"',
+                    lambda match: f'{match.group(1)}="{iso8601}"',
+                    daterange,
+                ),
+            )
+
     def _chk_live(self, seg_time):
         """
         _chk_live
@@ -283,11 +649,26 @@ class X9K3(strm.Stream):
         seg_name = self.mk_uri(self.args.output_dir, seg_file)
         seg_time = round((self.next_start- self.started) + self.rollover_duration_pad, 6)
         self.rollover_duration_pad = 0
-        with open(seg_name, "wb") as seg:
-            seg.write(self.active_segment.getbuffer())
         if seg_time <= 0:
+            self.writer.write_segment(seg_name, self.active_segment.getvalue())
             return
+        if self.pts_index:
+            self.pts_index.add(PtsIndex.SEGMENT, self.started, self.bytes_done, self.segnum)
+        self.bytes_done += self.active_segment.tell()
+        byterange = None
+        if self.args.byterange:
+            seg_file, byterange = self._byterange(seg_time)
+            seg_name = self.mk_uri(self.args.output_dir, seg_file)
         chunk = Chunk(seg_file, seg_name, self.segnum)
+        if self.args.part_time:
+            self._close_parts(chunk)
+        nbytes = self.active_segment.tell()
+        if byterange:
+            offset = self.media_offset
+            self.media_offset += nbytes
+            self.writer.append_segment(seg_name, self.active_segment, offset)
+        else:
+            self.writer.write_segment(seg_name, self.active_segment)
         # chunk.add_tag("## started",self.started)
         # chunk.add_tag("## next_start",self.next_start)
         # chunk.add_tag("## now",self.now)
@@ -295,15 +676,172 @@ class X9K3(strm.Stream):
             if self.args.replay or self.args.continue_m3u8:
                 self.add_discontinuity(chunk)
         self._mk_chunk_tags(chunk, seg_time)
+        if byterange:
+            chunk.add_tag("#EXT-X-BYTERANGE", byterange)
+        if self.kept is not None:
+            self._keep_segment(seg_name, nbytes, seg_time, chunk)
         self.window.slide_panes(chunk)
         self._write_m3u8()
+        self.active_segment = self.buffers.new()
         self._print_segment_details(seg_name, seg_time)
         self._start_next_start(pts = self.now)
         if self.scte35.break_timer is not None:
             self.scte35.break_timer += seg_time
         self.scte35.chk_cue_state()
+        self._write_checkpoint()
+        self._chk_live(seg_time)
+
+    def _keep_segment(self, seg_name, nbytes, seg_time, chunk):
+        """
+        _keep_segment keeps a hard link, or copy, of a first pass
+        segment in REPLAY_DIR, with it's start, duration and tags,
+        for replay_cached.
+        """
+        replay_dir = self.mk_uri(self.args.output_dir, REPLAY_DIR)
+        if self.writer.disk and not os.path.isdir(replay_dir):
+            os.mkdir(replay_dir)
+        kept = self.mk_uri(replay_dir, f"seg{len(self.kept)}.ts")
+        self.writer.keep(seg_name, kept)
+        self.kept.append((kept, nbytes, self.started, seg_time, dict(chunk.tags)))
+
+    def _replay_segment(self, kept, nbytes, start, seg_time, tags):
+        """
+        _replay_segment republishes a kept segment
+        as the next segment number.
+        """
+        seg_file = f"seg{self.segnum}.ts"
+        seg_name = self.mk_uri(self.args.output_dir, seg_file)
+        self.writer.republish(kept, seg_name)
+        chunk = Chunk(seg_file, seg_name, self.segnum)
+        chunk.tags = dict(tags)
+        self.started = start
+        self.next_start = start + seg_time
+        self._chk_daterange(chunk)
+        self._chk_pdt_flag(chunk)
+        self.window.slide_panes(chunk)
+        self._write_m3u8()
+        self._print_segment_details(seg_name, seg_time)
+        self._write_checkpoint()
         self._chk_live(seg_time)
 
+    def _sidecar_changed(self):
+        watcher = self.sidecar_watcher
+        return bool(watcher and any(line.strip() for line in watcher.poll()))
+
+    def replay_cached(self):
+        """
+        replay_cached loops the input again for args.replay
+        by republishing the segments kept from the first pass,
+        the input is not parsed again. Segment numbers, discontinuity
+        tags and the sliding window move on as usual,
+        and segments are still throttled to real time.
+
+        replay_cached returns False, without republishing,
+        when there are no kept segments or the sidecar file changed,
+        and the input has to be parsed again.
+        """
+        if not self.kept or self._sidecar_changed():
+            return False
+        if self.writer.maxsize > 0 and not self.writer.thread:
+            self.writer.start()
+        for kept in self.kept:
+            self._replay_segment(*kept)
+        return True
+
+    def _byterange(self, seg_time):
+        """
+        _byterange returns the rolling media file for the active segment
+        and it's #EXT-X-BYTERANGE.
+        A new media file is started every args.byterange minutes.
+        """
+        if self.media_file is None or self.media_secs >= self.args.byterange * 60:
+            self.media_file = f"media{self.segnum}.ts"
+            self.media_offset = 0
+            self.media_secs = 0
+        self.media_secs += seg_time
+        return self.media_file, f"{self.active_segment.tell()}@{self.media_offset}"
+
+    def _chk_part_point(self):
+        """
+        _chk_part_point cuts a LL-HLS part before this PES
+        when the part would run past args.part_time.
+        Full segments are still only cut by _chk_slice_point.
+        """
+        step = 0
+        if self.last_pes is not None:
+            step = max(self.now - self.last_pes, 0)
+        self.last_pes = self.now
+        if self.part_start is None:
+            self.part_start = self.started
+        if round(self.now + step - self.part_start, 3) > self.args.part_time:
+            self._write_part(self.now)
+            self._write_part_m3u8()
+
+    def _write_part(self, end):
+        """
+        _write_part writes the bytes of the active segment
+        since the last part as the next part.
+        """
+        if self.active_segment.tell() == self.part_offset:
+            return
+        segnum = self.segnum or 0
+        part_file = f"seg{segnum}.{len(self.parts)}.ts"
+        part_name = self.mk_uri(self.args.output_dir, part_file)
+        data = SegmentBuffers.read(self.active_segment, self.part_offset)
+        self.writer.write_segment(part_name, data)
+        duration = max(end - self.part_start, 0)
+        part = f'#EXT-X-PART:DURATION={duration:.6f},URI="{part_file}"'
+        if not self.parts:
+            part += ",INDEPENDENT=YES"
+        self.parts.append(part)
+        self.part_names.append(part_name)
+        self.part_offset = self.active_segment.tell()
+        self.part_start = end
+
+    def _close_parts(self, chunk):
+        """
+        _close_parts writes the last part of the segment,
+        moves the parts to chunk, and drops parts
+        of segments older than PART_SEGMENTS from the playlist.
+        Part files are removed one segment later.
+        """
+        self._write_part(self.next_start)
+        chunk.parts = self.parts
+        self.part_chunks.append((chunk, self.part_names))
+        self.parts = []
+        self.part_names = []
+        self.part_offset = 0
+        self.part_start = None
+        if len(self.part_chunks) > PART_SEGMENTS:
+            old_chunk, old_names = self.part_chunks.popleft()
+            old_chunk.parts = []
+            old_chunk.text = None
+            self.stale_parts.append(old_names)
+            if len(self.stale_parts) > 1:
+                for part_name in self.stale_parts.popleft():
+                    self.writer.discard(part_name)
+
+    def _part_tail(self, segnum):
+        """
+        _part_tail returns the parts of the segment being cut
+        and the preload hint for the next part.
+        """
+        hint = f"seg{segnum}.{len(self.parts)}.ts"
+        lines = self.parts + [f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{hint}"', ""]
+        return PartTail("\n".join(lines))
+
+    def _write_part_m3u8(self):
+        """
+        _write_part_m3u8 writes the index.m3u8
+        with the parts of the segment being cut.
+        """
+        segnum = self.segnum or 0
+        panes = list(self.window.panes) + [self._part_tail(segnum)]
+        position = (segnum - 1, segnum, len(self.parts) - 1)
+        self.writer.write_playlist(
+            self.m3u8uri(), self._header(), panes, True, position
+        )
+
     def _clear_endlist(self, lines):
         return [line for line in lines if not self._endlist(line)]
 
@@ -318,12 +856,18 @@ class X9K3(strm.Stream):
         _write_m3u8 writes the index.m3u8
         """
         self.media_seq = self.window.panes[0].num
-        with open(self.m3u8uri(), "w+", encoding="utf8") as m3u8:
-            m3u8.write(self._header())
-            m3u8.write(self.window.all_panes())
-            self.segnum += 1
-            self.first_segment = False
-        self.active_segment = io.BytesIO()
+        if self.args.part_time:
+            panes = list(self.window.panes) + [self._part_tail(self.segnum + 1)]
+            position = (self.segnum, self.segnum + 1, -1)
+            self.writer.write_playlist(
+                self.m3u8uri(), self._header(), panes, True, position
+            )
+        else:
+            self.writer.write_playlist(
+                self.m3u8uri(), self._header(), list(self.window.panes), self.args.live
+            )
+        self.segnum += 1
+        self.first_segment = False
         self.window.slide_panes()
 
     def _load_sidecar(self):
@@ -333,21 +877,31 @@ class X9K3(strm.Stream):
         if live, blank out the sidecar file after cues are loaded.
         """
         if self.args.sidecar_file:
-            with reader(self.args.sidecar_file) as sidefile:
-                sidelines = sidefile.readlines()
-                if sidelines == self.last_sidelines:
-                    return
-                for line in sidelines:
-                    line = line.decode().strip().split("#", 1)[0]
-                    if len(line):
-                        if float(line.split(",", 1)[0]) == 0.0:
-                            if self.args.live:
-                                #line = f'{self.next_start},{line.split(",",1)[1]}'
-                                line = f'{self.now},{line.split(",",1)[1]}' 
-
-                        self.add2sidecar(line)
-                sidefile.close()
-                self.last_sidelines = sidelines
+            if not self.sidecar_watcher:
+                self.sidecar_watcher = SidecarWatcher(
+                    self.args.sidecar_file, self.args.sidecar_interval
+                )
+            if not self.sidecar_watcher.due(self.segnum):
+                return
+            lines = self.sidecar_watcher.poll()
+            if not self.args.live:
+                lines += self.sidecar_watcher.flush()
+            for line in lines:
+                line = line.decode(errors="replace").strip().split("#", 1)[0]
+                if len(line):
+                    try:
+                        insert_pts, cue = line.split(",", 1)
+                        insert_pts = float(insert_pts)
+                        Cue(cue.strip()).decode()
+                    except Exception:  # pylint: disable=broad-except
+                        print2(f"skipping bad sidecar line: {line}")
+                        continue
+                    if insert_pts == 0.0:
+                        if self.args.live:
+                            #line = f'{self.next_start},{cue}'
+                            line = f'{self.now},{cue}' 
+
+                    self.add2sidecar(line)
 
     def _clear_sidecar_file(self):
         if self.args.live and not self.args.replay:
@@ -356,32 +910,26 @@ class X9K3(strm.Stream):
 
     def add2sidecar(self, line):
         """
-        add2sidecar add insert_pts,cue to the deque
+        add2sidecar add insert_pts,cue to the cue schedule
         """
         insert_pts, cue = line.split(",", 1)
-        insert_pts = float(insert_pts)
-        if [insert_pts, cue] not in self.sidecar:
-            self.sidecar.append([insert_pts, cue])
-            self.sidecar = deque(sorted(self.sidecar, key=itemgetter(0)))
+        self.sidecar.add(float(insert_pts), cue)
 
     def _chk_sidecar_cues(self, pid):
         """
         _chk_sidecar_cues checks the insert pts time
         for the next sidecar cue and inserts the cue if needed.
         """
-        if self.sidecar:
-            for s in list(self.sidecar):
-                splice_pts = float(s[0])
-                splice_cue = s[1]
-                if self.started:
-                    if self.started <= splice_pts <self.next_start:
-                        self.sidecar.remove(s)
-                        self.scte35.cue_time = splice_pts
-                        self.scte35.cue = Cue(splice_cue)
-                        self.scte35.cue.decode()
-                        self.scte35.cue.show()
-                        self._chk_cue_time(pid)
-
+        if self.sidecar and self.started:
+            for splice_pts, splice_cue in self.sidecar.pop_due(
+                self.started, self.next_start
+            ):
+                self.scte35.cue_time = splice_pts
+                self.scte35.cue = Cue(splice_cue)
+                self.scte35.cue.decode()
+                self.scte35.cue.show()
+                self._chk_cue_time(pid)
+                self._index_cue()
 
     def _discontinuity_seq_plus_one(self):
         if self.window.panes:
@@ -432,6 +980,35 @@ class X9K3(strm.Stream):
         if self.scte35.cue:
             self.scte35.cue_time = self.adjusted_pts(self.scte35.cue, pid)
 
+    def _index_cue(self):
+        """
+        _index_cue writes a PtsIndex CUE record for a cue
+        as it is applied. In stream cues are applied
+        from the cue schedule too, so each cue is indexed once.
+        """
+        if self.pts_index:
+            self.pts_index.add(
+                PtsIndex.CUE,
+                self.scte35.cue_time,
+                self._offset(),
+                self.scte35.cue.command.command_type,
+            )
+
+    def _offset(self):
+        """
+        _offset returns the input byte offset of the current packet,
+        counted from the first sync byte.
+        """
+        return self.bytes_done + self.active_segment.tell()
+
+    def _index_keyframe(self, pts):
+        if self.pts_index:
+            self.pts_index.add(PtsIndex.KEYFRAME, pts, self._offset())
+        if self.scan is not None:
+            if self.scan["start"] is None:
+                self.scan["start"] = self.started
+            self.scan["keyframes"].append((self._offset(), pts))
+
     def adjusted_pts(self, cue, pid):
         """
         adjusted_pts = (pts_time + pts_adjustment) % self.ROLLOVER
@@ -457,6 +1034,7 @@ class X9K3(strm.Stream):
         _shulga_mode is mpeg2 video iframe detection
         """
         if self._rai_flag(pkt):
+            self._index_keyframe(self.now)
             self._chk_slice_point()
 
     def _parse_scte35(self, pkt, pid):
@@ -467,11 +1045,20 @@ class X9K3(strm.Stream):
         cue = super()._parse_scte35(pkt, pid)
         if cue:
             cue.decode()
-            self.scte35.cue = cue
-            self._chk_cue_time(pid)
-            self.add2sidecar(f"{self.adjusted_pts(cue, pid)}, {cue.encode()}")
+            if self.scan is not None:
+                self.scan["cues"].append((self._offset(), self.pid2pts(pid), cue.encode()))
+            self._apply_cue(cue, pid)
         return cue
 
+    def _apply_cue(self, cue, pid):
+        """
+        _apply_cue sets a decoded in stream cue
+        and adds it to the cue schedule.
+        """
+        self.scte35.cue = cue
+        self._chk_cue_time(pid)
+        self.add2sidecar(f"{self.adjusted_pts(cue, pid)}, {cue.encode()}")
+
     def _parse(self, pkt):
         """
         _parse is run on every packet.
@@ -484,14 +1071,123 @@ class X9K3(strm.Stream):
         self._chk_sidecar_cues(pkt_pid)
         if self._pusi_flag(pkt) and self.started:
             self._load_sidecar()
+            if self.args.part_time:
+                self._chk_part_point()
             if self.args.shulga:
                 self._shulga_mode(pkt)
             else:
                 i_pts = self.iframer.parse(pkt)
                 if i_pts:
+                    self._index_keyframe(i_pts)
                     self._chk_slice_point()
         self.active_segment.write(pkt)
 
+    def _watched_pids(self):
+        """
+        _watched_pids returns the pids that always
+        need the per packet slow path, PAT, PMT, SDT and SCTE-35.
+        """
+        return self.pids.tables | self.pids.scte35
+
+    @staticmethod
+    def _scan_block(block, watched):
+        """
+        _scan_block finds the packets in a block of whole packets
+        that are PUSI or on a watched pid.
+        Returns a list of packet indexes.
+        """
+        numpy = _numpy()
+        if numpy is not None:
+            pkts = numpy.frombuffer(block, dtype=numpy.uint8).reshape(-1, PKT_SIZE)
+            byte1 = pkts[:, 1]
+            pids = ((byte1 & 0x1F).astype(numpy.uint16) << 8) | pkts[:, 2]
+            slow = (byte1 & 0x40) != 0
+            if watched:
+                slow |= numpy.isin(pids, list(watched))
+            return numpy.flatnonzero(slow).tolist()
+        return [
+            idx
+            for idx in range(len(block) // PKT_SIZE)
+            if block[idx * PKT_SIZE + 1] & 0x40
+            or ((block[idx * PKT_SIZE + 1] & 0x1F) << 8 | block[idx * PKT_SIZE + 2])
+            in watched
+        ]
+
+    def _parse_run(self, block, first, last):
+        """
+        _parse_run handles packets first up to last
+        that need no per packet parsing.
+        State can only change on a slow path packet,
+        so the checks _parse runs are done once for the run
+        and the packets are bulk copied to the active segment.
+        """
+        start = first * PKT_SIZE
+        pkt_pid = self._parse_pid(block[start + 1], block[start + 2])
+        self.now = self.pid2pts(pkt_pid)
+        if not self.started:
+            self._start_next_start(pts=self.now)
+        self._chk_sidecar_cues(pkt_pid)
+        self.active_segment.write(block[start : last * PKT_SIZE])
+
+    def _parse_block(self, block):
+        """
+        _parse_block is the batch mode version of _parse.
+        block is a memoryview of one or more packets.
+        Only PUSI packets and PAT, PMT and SCTE-35 packets
+        go through _parse, the runs in between are bulk copied.
+        """
+        whole = len(block) // PKT_SIZE
+        watched = self._watched_pids()
+        slow = self._scan_block(block[: whole * PKT_SIZE], watched)
+        idx = 0
+        pos = 0
+        while pos < len(slow):
+            pkt_idx = slow[pos]
+            pos += 1
+            if pkt_idx > idx:
+                self._parse_run(block, idx, pkt_idx)
+            start = pkt_idx * PKT_SIZE
+            self._parse(bytes(block[start : start + PKT_SIZE]))
+            idx = pkt_idx + 1
+            if self._watched_pids() != watched:
+                # a new PMT or SCTE-35 pid showed up, rescan what's left.
+                watched = self._watched_pids()
+                rest = self._scan_block(block[idx * PKT_SIZE : whole * PKT_SIZE], watched)
+                slow = [idx + pkt for pkt in rest]
+                pos = 0
+        if whole > idx:
+            self._parse_run(block, idx, whole)
+        if len(block) > whole * PKT_SIZE:
+            self._parse(bytes(block[whole * PKT_SIZE :]))
+
+    def _iter_blocks(self, num_pkts=BATCH_PKTS):
+        """
+        _iter_blocks reads packet aligned blocks
+        of up to num_pkts packets as memoryviews.
+        """
+        size = PKT_SIZE * num_pkts
+        tail = b""
+        chunk = self._tsdata.read(size)
+        while chunk:
+            if tail:
+                chunk = tail + chunk
+            cut = len(chunk) - (len(chunk) % PKT_SIZE)
+            tail = chunk[cut:]
+            if cut:
+                yield memoryview(chunk)[:cut]
+            chunk = self._tsdata.read(size)
+        if tail:
+            yield memoryview(tail)
+
+    def iter_pkts(self, num_pkts=1, batch=False):
+        """
+        iter_pkts iterates packets,
+        when batch is set, packet aligned blocks are iterated.
+        """
+        if batch:
+            return self._iter_blocks(max(num_pkts, BATCH_PKTS))
+        return super().iter_pkts(num_pkts)
+
     def addendum(self):
         """
         addendum post stream parsing related tasks.
@@ -500,13 +1196,49 @@ class X9K3(strm.Stream):
             when the replay flag or continue_m3u8 flag is set.
             * adding endlist tag
         """
-        buff = self.active_segment.getbuffer()
+        buff = self.active_segment.tell()
         if buff:
             self._write_segment()
-            time.sleep(0.5)
+        self.writer.close()
+        self.buffers.discard(self.active_segment)
+        self.buffers.close()
+        if buff:
+            time.sleep(self.end_sleep)
         if not self.args.live:
-            with open(self.m3u8uri(), "a", encoding="utf8") as m3u8:
-                m3u8.write("#EXT-X-ENDLIST")
+            if self.writer.disk:
+                with open(self.m3u8uri(), "a", encoding="utf8") as m3u8:
+                    m3u8.write("#EXT-X-ENDLIST")
+            if self.writer.store is not None:
+                self.writer.store.append(self.m3u8uri(), "#EXT-X-ENDLIST")
+        if self.pts_index:
+            self.pts_index.close()
+        if not self.kept:
+            self.close()
+
+    def follow(self, x9):
+        """
+        follow carries the timer, MemoryStore and pending
+        deletes of x9, the last instance on the same stream,
+        over to this one, and closes x9.
+        The --replay loops call it when the input is parsed again.
+        """
+        self.timer.follow(x9.timer)
+        self.writer.store = x9.writer.store
+        self.reaper.follow(x9.reaper)
+        x9.close()
+
+    def close(self):
+        """
+        close stops the metrics and origin servers,
+        and the reaper, deleting what it has left.
+        addendum calls close, unless segments were kept
+        for replay_cached.
+        """
+        self.reaper.close()
+        if self.metrics:
+            self.metrics.close()
+        if self.origin:
+            self.origin.close()
 
     def decode(self, func=False):
         """
@@ -515,12 +1247,152 @@ class X9K3(strm.Stream):
         addendum is called to finish. 
         """
         self.apply_args()
-        self.timer.start()
         if isinstance(self.args.input, str) and ("m3u8" in self.args.input):
             self.decode_m3u8(self.args.input)
+        elif self.cached:
+            self.decode_cached()
+        elif self.args.parallel:
+            self.decode_parallel()
         else:
-            super().decode()
+            self.decode_serial()
         self.addendum()
+        if self.scan is not None:
+            self.index_cache.save(self.scan, self.bytes_done)
+
+    def decode_serial(self):
+        """
+        decode_serial parses the input in one pass,
+        memory mapped, batched, or packet by packet.
+        """
+        if self.args.mmap:
+            self.decode_mmap()
+        elif self.args.batch:
+            self.decode_batch()
+        else:
+            super().decode()
+
+    def decode_batch(self):
+        """
+        decode_batch parses the input in packet aligned blocks,
+        used when the batch flag is set.
+        """
+        self._find_start()
+        for block in self.iter_pkts(batch=True):
+            self._parse_block(block)
+
+    def decode_cached(self):
+        """
+        decode_cached segments a VOD input from a cached scan
+        of it's keyframes and SCTE-35 cues, used when
+        the index_cache arg is set and the input was scanned before.
+        The same cut point checks are run at each keyframe,
+        and segments are copied from byte ranges of the input.
+        Single program streams only, pts is kept for program 1.
+        """
+        scan = self.cached
+        path = self.args.input
+        skip = scan["skip"]
+        events = sorted(
+            [(offset, pts, None) for offset, pts in scan["keyframes"]]
+            + [(offset, pts, cue) for offset, pts, cue in scan["cues"]]
+        )
+        self._start_next_start(pts=scan["start"])
+        pid = 0
+        self._chk_sidecar_cues(pid)
+        for offset, pts, cue in events:
+            self.maps.prgm_pts[1] = round(pts * 90000)
+            self.now = pts
+            if cue:
+                cue = Cue(cue)
+                cue.decode()
+                self._apply_cue(cue, pid)
+                self._chk_sidecar_cues(pid)
+                continue
+            self._chk_sidecar_cues(pid)
+            self._load_sidecar()
+            self.active_segment = RangeSegment(
+                path, skip + self.bytes_done, skip + offset
+            )
+            self._index_keyframe(pts)
+            self._chk_slice_point()
+            self._chk_sidecar_cues(pid)
+        self.active_segment = RangeSegment(
+            path, skip + self.bytes_done, skip + scan["end"]
+        )
+
+    def decode_parallel(self):
+        """
+        decode_parallel segments a VOD input with
+        args.parallel worker processes, used when
+        the parallel arg is set.
+        The input is split in packet aligned ranges,
+        each worker scans it's range for keyframes and cues,
+        from it's first keyframe to the first keyframe
+        of the next range. The scans are joined,
+        and decode_cached cuts the segments in order,
+        so numbering, #EXTINF and cue state run across ranges.
+        Inputs too small to split, or with no pts,
+        are decoded serially.
+        """
+        from concurrent.futures import (  # pylint: disable=import-outside-toplevel
+            ProcessPoolExecutor,
+        )
+
+        path = self.args.input
+        size = os.path.getsize(path)
+        with open(path, "rb") as media:
+            with mmap.mmap(media.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                skip = mapping.find(b"\x47")
+        if skip < 0:
+            print2("\nNo Stream Found. \n")
+            return
+        workers = self.args.parallel
+        step = (size - skip) // PKT_SIZE // workers * PKT_SIZE
+        if step < PKT_SIZE * BATCH_PKTS:
+            self.decode_serial()
+            return
+        bounds = [skip + step * idx for idx in range(workers)] + [size]
+        jobs = [
+            (path, skip, bounds[idx], bounds[idx + 1], self.args.shulga)
+            for idx in range(workers)
+        ]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scans = [scan for scan in pool.map(scan_range, jobs) if scan]
+        starts = [scan["start"] for scan in scans if scan["start"] is not None]
+        if not starts:
+            self.decode_serial()
+            return
+        self.cached = {
+            "start": starts[0],
+            "keyframes": [pair for scan in scans for pair in scan["keyframes"]],
+            "cues": [cue for scan in scans for cue in scan["cues"]],
+            "end": size - skip,
+            "skip": skip,
+        }
+        scan, self.scan = self.scan, None
+        self.decode_cached()
+        if scan is not None:
+            self.scan = self.cached
+
+    def decode_mmap(self):
+        """
+        decode_mmap parses a memory mapped local file
+        in packet aligned memoryview blocks, used when
+        the mmap flag is set. Only the packets _parse_block
+        sends through _parse are copied, segments are
+        saved from slices of the mapping.
+        """
+        mapping = self.buffers.mapping
+        start = mapping.find(b"\x47")
+        if start < 0:
+            print2("\nNo Stream Found. \n")
+            return
+        self.buffers.pos = start
+        self.active_segment = self.buffers.new()
+        size = PKT_SIZE * BATCH_PKTS
+        with memoryview(mapping) as view:
+            for pos in range(start, len(mapping), size):
+                self._parse_block(view[pos : pos + size])
 
     @staticmethod
     def _clean_line(line):
@@ -529,114 +1401,495 @@ class X9K3(strm.Stream):
         line = line.replace("\n", "").replace("\r", "")
         return line
 
+    def _parse_media(self, tsdata):
+        self._tsdata = tsdata
+        if self.args.batch:
+            for block in self.iter_pkts(batch=True):
+                self._parse_block(block)
+        else:
+            for pkt in self.iter_pkts():
+                self._parse(pkt)
+        self._tsdata.close()
+
     def parse_m3u8_media(self, media):
         """
         parse_m3u8_media parse a segment from
         a m3u8 input file if it has not been parsed.
         """
-        max_media = 111
-        if media not in self.media_list:
-            self.media_list.append(media)
-            while len(self.media_list) > max_media:
-                self.media_list.popleft()
-            self._tsdata = reader(media)
-            for pkt in self.iter_pkts():
-                self._parse(pkt)
-            self._tsdata.close()
+        if self.media_list.add(media):
+            self._parse_media(reader(media))
 
     def decode_m3u8(self, manifest=None):
         """
         decode_m3u8 is called when the input file is a m3u8 playlist.
+        The playlist is polled by a PlaylistPoller.
+        With self.args.prefetch set, the next segments are
+        downloaded while the current segment is parsed.
         """
-        based = manifest.rsplit("/", 1)
-        if len(based) > 1:
-            base_uri = f"{based[0]}/"
-        else:
-            base_uri = ""
-        while True:
-            with reader(manifest) as manifesto:
-                m3u8 = manifesto.readlines()
-                for line in m3u8:
-                    if not line:
-                        break
-                    line = self._clean_line(line)
-                    if self._endlist(line):
-                        return False
-                    if line.startswith("#"):
-                        media = None
-                    else:
-                        media = line
-                    if media:
-                        if base_uri not in media:
-                            media = base_uri + media
-                        self.parse_m3u8_media(media)
+        self.poller = PlaylistPoller(manifest, self.media_list)
+        prefetcher = SegmentPrefetcher(self.args.prefetch)
+        try:
+            while True:
+                medias = self.poller.poll()
+                for idx, media in enumerate(medias):
+                    prefetcher.want(medias[idx + 1 : idx + 1 + prefetcher.ahead])
+                    self._parse_media(prefetcher.get(media))
+                    self.poller.parsed(media)
+                if self.poller.endlist:
+                    return False
+                self.poller.wait()
+        finally:
+            prefetcher.close()
+            if self.poller.polls > 1:
+                print2(f"playlist poller: {self.poller.stats()}")
 
 
-class SCTE35:
+class RangeScanner(X9K3):
     """
-    A SCTE35 instance is used to hold
-    SCTE35 cue data by X9K5.
+    RangeScanner scans a packet aligned range of a file
+    for keyframes and SCTE-35 cues for decode_parallel.
+    No segments are cut.
+
+    A range after the first starts recording
+    at it's first keyframe, the first range records from
+    it's first pts, keyframe or not. Every range stops
+    at the first keyframe past it's end,
+    where the next range starts recording.
+    PAT and PMT are read from the start of the file first.
     """
 
-    def __init__(self):
-        self.cue = None
-        self.cue_state = None
-        self.cue_time = None
-        self.tag_method = self.x_cue
-        self.break_timer = None
-        self.break_duration = None
-        self.event_id = 1
-        self.seg_type = None
+    def __init__(self, path, skip, start, stop, shulga=False):
+        super().__init__(args=Config(input=path, shulga=shulga))
+        self.skip = skip
+        self.start_at = start
+        self.stop = stop - skip
+        self.stopped = False
+        self.result = None
+        with open(path, "rb") as media:
+            self.buffers.mapping = mmap.mmap(
+                media.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        if start == skip:
+            self.scan = self.result = {"start": None, "keyframes": [], "cues": []}
 
-    def mk_cue_tag(self):
-        """
-        mk_cue_tag routes  hls tag creation
-        to the appropriate method.
-        """
-        tag = False
-        if self.cue:
-            tag = self.tag_method()
-        return tag
+    def _chk_slice_point(self):
+        pass
 
-    def chk_cue_state(self):
+    def _index_keyframe(self, pts):
+        if self._offset() >= self.stop:
+            self.scan = None
+            self.stopped = True
+            return
+        if self.result is None:
+            self.scan = self.result = {"start": None, "keyframes": [], "cues": []}
+        super()._index_keyframe(pts)
+
+    def _prime(self):
         """
-        chk_cue_state changes
-        OUT to CONT
-        and IN to None
-        when the cue is expired.
+        _prime reads PAT and PMT from the start of the file.
         """
-        if self.cue_state == "OUT":
-            self.cue_state = "CONT"
-        if self.cue_state == "IN":
-            self.cue_time = None
-            self.cue = None
-            self.cue_state = None
-            self.break_timer = None
+        mapping = self.buffers.mapping
+        for pos in range(self.skip, self.start_at, PKT_SIZE):
+            if self.pids.pcr:
+                return
+            strm.Stream._parse(self, mapping[pos : pos + PKT_SIZE])
 
-    def mk_cue_state(self):
+    def run(self):
         """
-        mk_cue_state checks if the cue
-        is a CUE-OUT or a CUE-IN and
-        sets cue_state.
+        run scans the range and returns
+        the scan, or None if it has no keyframes.
         """
-        if self.is_cue_out(self.cue):
-            self.cue_state = "OUT"
-            self.break_timer = 0.0
-        if self.is_cue_in(self.cue):
-            if self.break_timer >= self.break_duration:
-                self.cue_state = "IN"
+        mapping = self.buffers.mapping
+        self._prime()
+        self.bytes_done = self.start_at - self.skip
+        self.buffers.pos = self.start_at
+        self.active_segment = self.buffers.new()
+        size = PKT_SIZE * BATCH_PKTS
+        with memoryview(mapping) as view:
+            for pos in range(self.start_at, len(mapping), size):
+                self._parse_block(view[pos : pos + size])
+                if self.stopped:
+                    break
+        self.buffers.discard(self.active_segment)
+        self.buffers.close()
+        if self.result is not None and self.result["start"] is None:
+            self.result["start"] = self.started
+        return self.result
 
-    def x_cue(self):
+
+def scan_range(job):
+    """
+    scan_range runs a RangeScanner,
+    it runs in a decode_parallel worker process.
+    """
+    return RangeScanner(*job).run()
+
+
+class MediaHistory:
+    """
+    MediaHistory remembers the last maxlen
+    m3u8 media uris that were parsed.
+    """
+
+    def __init__(self, maxlen=111):
+        self.maxlen = maxlen
+        self.order = deque()
+        self.seen = set()
+
+    def __contains__(self, media):
+        return media in self.seen
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, media):
         """
-        #EXT-X-CUE-( OUT | IN | CONT )
+        add returns True and adds media
+        if media is not in the history.
         """
-        if self.cue_state == "OUT":
-            return f"#EXT-X-CUE-OUT:{self.break_duration}"
-        if self.cue_state == "IN":
-            return "#EXT-X-CUE-IN"
-        if self.cue_state == "CONT":
-            return f"#EXT-X-CUE-OUT-CONT:{self.break_timer:.6f}/{self.break_duration}"
-        return False
+        if media in self.seen:
+            return False
+        self.seen.add(media)
+        self.order.append(media)
+        if len(self.order) > self.maxlen:
+            self.seen.discard(self.order.popleft())
+        return True
+
+
+class PlaylistPoller:
+    """
+    PlaylistPoller reloads a m3u8 playlist
+    and returns the media segments that are new.
+
+    Local playlists are checked with os.stat,
+    urls are requested with If-None-Match and If-Modified-Since.
+    Segments are new when their media sequence number
+    is past the last one seen, or, without #EXT-X-MEDIA-SEQUENCE,
+    when their uri is not in the history.
+
+    wait sleeps for the target duration after a reload
+    with new segments, and backs off from half the target duration
+    up to BACKOFF target durations while nothing changes.
+    """
+
+    BACKOFF = 3
+    DEFAULT_TARGET = 2.0
+
+    def __init__(self, manifest, history=None):
+        self.manifest = manifest
+        based = manifest.rsplit("/", 1)
+        self.base_uri = ""
+        if len(based) > 1:
+            self.base_uri = f"{based[0]}/"
+        self.history = history if history is not None else MediaHistory()
+        self.target = None
+        self.endlist = False
+        self.first_seq = None
+        self.last_seq = None
+        self.key = None
+        self.validators = {}
+        self.last_poll = None
+        self.misses = 0
+        self.polls = 0
+        self.unchanged = 0
+        self.new_segments = 0
+        self.last_new = 0
+        self.pending = {}
+        self.behind = 0.0
+        self.max_behind = 0.0
+
+    def _is_local(self):
+        return "://" not in self.manifest or os.path.exists(self.manifest)
+
+    def _read_local(self):
+        try:
+            stat = os.stat(self.manifest)
+        except OSError:
+            stat = None
+        if stat:
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if key == self.key:
+                return None
+            self.key = key
+        with reader(self.manifest) as manifesto:
+            return manifesto.readlines()
+
+    def _read_remote(self):
+        headers = {}
+        if "ETag" in self.validators:
+            headers["If-None-Match"] = self.validators["ETag"]
+        if "Last-Modified" in self.validators:
+            headers["If-Modified-Since"] = self.validators["Last-Modified"]
+        try:
+            with reader(self.manifest, headers=headers) as manifesto:
+                lines = manifesto.readlines()
+                for validator in ("ETag", "Last-Modified"):
+                    value = getattr(manifesto, "headers", {}).get(validator)
+                    if value:
+                        self.validators[validator] = value
+        except urllib.error.HTTPError as err:
+            if err.code == 304:
+                return None
+            raise
+        if lines == self.key:
+            return None
+        self.key = lines
+        return lines
+
+    def _read(self):
+        """
+        _read returns the playlist lines,
+        or None if the playlist has not changed.
+        """
+        if self._is_local():
+            return self._read_local()
+        return self._read_remote()
+
+    def _uri(self, media):
+        if self.base_uri not in media:
+            media = self.base_uri + media
+        return media
+
+    def _segments(self, lines):
+        """
+        _segments returns a list of (uri, media sequence, duration)
+        for each segment in lines, and sets
+        self.target and self.endlist.
+        """
+        segments = []
+        seq = None
+        duration = 0.0
+        for line in lines:
+            if not line:
+                break
+            line = X9K3._clean_line(line)
+            if X9K3._endlist(line):
+                self.endlist = True
+                break
+            if line.startswith("#EXT-X-TARGETDURATION:"):
+                self.target = float(line.split(":", 1)[1])
+            elif line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                seq = int(line.split(":", 1)[1])
+            elif line.startswith("#EXTINF:"):
+                duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            elif line and not line.startswith("#"):
+                segments.append((self._uri(line), seq, duration))
+                if seq is not None:
+                    seq += 1
+                duration = 0.0
+        return segments
+
+    def _is_new(self, media, seq):
+        if seq is not None and self.last_seq is not None and seq <= self.last_seq:
+            return False
+        return self.history.add(media)
+
+    def poll(self):
+        """
+        poll reloads the playlist and returns
+        a list of new media segment uris.
+        """
+        self.last_poll = time.monotonic()
+        self.polls += 1
+        lines = self._read()
+        if lines is None:
+            self.unchanged += 1
+            return self._missed()
+        segments = self._segments(lines)
+        if segments and segments[0][1] is not None:
+            if self.first_seq is not None and segments[0][1] < self.first_seq:
+                self.last_seq = None
+            self.first_seq = segments[0][1]
+        medias = []
+        for media, seq, duration in segments:
+            if self._is_new(media, seq):
+                medias.append(media)
+                self.pending[media] = duration
+                self.behind += duration
+            if seq is not None:
+                self.last_seq = max(seq, self.last_seq or seq)
+        if not medias:
+            return self._missed()
+        self.misses = 0
+        self.last_new = len(medias)
+        self.new_segments += len(medias)
+        self.max_behind = max(self.max_behind, self.behind)
+        return medias
+
+    def _missed(self):
+        self.misses += 1
+        self.last_new = 0
+        return []
+
+    def parsed(self, media):
+        """
+        parsed marks media as parsed,
+        moving us closer to the live edge.
+        """
+        self.behind = max(self.behind - self.pending.pop(media, 0.0), 0.0)
+
+    def delay(self):
+        """
+        delay returns the seconds to wait
+        between the last poll and the next one.
+        """
+        target = self.target or self.DEFAULT_TARGET
+        if not self.misses:
+            return target
+        return min(target / 2 * 2 ** (self.misses - 1), target * self.BACKOFF)
+
+    def wait(self):
+        """
+        wait sleeps until the next poll is due.
+        """
+        if self.last_poll is None:
+            return
+        diff = self.last_poll + self.delay() - time.monotonic()
+        if diff > 0:
+            time.sleep(diff)
+
+    def stats(self):
+        """
+        stats returns polling stats
+        and how many seconds behind the live edge we are.
+        """
+        polls = max(self.polls, 1)
+        return {
+            "polls": self.polls,
+            "unchanged": self.unchanged,
+            "new_segments": self.new_segments,
+            "last_new": self.last_new,
+            "new_per_poll": round(self.new_segments / polls, 3),
+            "behind": round(self.behind, 3),
+            "max_behind": round(self.max_behind, 3),
+            "next_poll": round(self.delay(), 3),
+        }
+
+
+class SegmentPrefetcher:
+    """
+    SegmentPrefetcher downloads up to ahead
+    m3u8 media segments into memory
+    with a pool of ahead threads.
+    With ahead set to 0, segments are read when needed.
+    """
+
+    def __init__(self, ahead=0):
+        self.ahead = ahead
+        self.pool = None
+        if ahead:
+            from concurrent.futures import (  # pylint: disable=import-outside-toplevel
+                ThreadPoolExecutor,
+            )
+
+            self.pool = ThreadPoolExecutor(max_workers=ahead)
+        self.pending = {}
+
+    @staticmethod
+    def fetch(media):
+        """
+        fetch reads a media segment
+        """
+        with reader(media) as seg:
+            return seg.read()
+
+    def want(self, medias):
+        """
+        want starts downloading medias in order,
+        keeping at most self.ahead downloads pending.
+        """
+        for media in medias:
+            if len(self.pending) >= self.ahead:
+                return
+            if media not in self.pending:
+                self.pending[media] = self.pool.submit(self.fetch, media)
+
+    def get(self, media):
+        """
+        get returns media to read from,
+        the bytes of a pending download, waiting for it if needed,
+        or a reader streaming media when it's not pending.
+        """
+        if media in self.pending:
+            return io.BytesIO(self.pending.pop(media).result())
+        return reader(media)
+
+    def close(self):
+        """
+        close cancels pending downloads and stops the pool.
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+
+
+class SCTE35:
+    """
+    A SCTE35 instance is used to hold
+    SCTE35 cue data by X9K5.
+    """
+
+    def __init__(self):
+        self.cue = None
+        self.cue_state = None
+        self.cue_time = None
+        self.tag_method = self.x_cue
+        self.break_timer = None
+        self.break_duration = None
+        self.event_id = 1
+        self.seg_type = None
+
+    def mk_cue_tag(self):
+        """
+        mk_cue_tag routes  hls tag creation
+        to the appropriate method.
+        """
+        tag = False
+        if self.cue:
+            tag = self.tag_method()
+        return tag
+
+    def chk_cue_state(self):
+        """
+        chk_cue_state changes
+        OUT to CONT
+        and IN to None
+        when the cue is expired.
+        """
+        if self.cue_state == "OUT":
+            self.cue_state = "CONT"
+        if self.cue_state == "IN":
+            self.cue_time = None
+            self.cue = None
+            self.cue_state = None
+            self.break_timer = None
+
+    def mk_cue_state(self):
+        """
+        mk_cue_state checks if the cue
+        is a CUE-OUT or a CUE-IN and
+        sets cue_state.
+        """
+        if self.is_cue_out(self.cue):
+            self.cue_state = "OUT"
+            self.break_timer = 0.0
+        if self.is_cue_in(self.cue):
+            if self.break_timer >= self.break_duration:
+                self.cue_state = "IN"
+
+    def x_cue(self):
+        """
+        #EXT-X-CUE-( OUT | IN | CONT )
+        """
+        if self.cue_state == "OUT":
+            return f"#EXT-X-CUE-OUT:{self.break_duration}"
+        if self.cue_state == "IN":
+            return "#EXT-X-CUE-IN"
+        if self.cue_state == "CONT":
+            return f"#EXT-X-CUE-OUT-CONT:{self.break_timer:.6f}/{self.break_duration}"
+        return False
 
     def x_splicepoint(self):
         """
@@ -662,186 +1915,1880 @@ class SCTE35:
             return f"{base},CUE-OUT=CONT"
         return False
 
-    def x_daterange(self):
+    def x_daterange(self):
+        """
+        #EXT-X-DATERANGE
+        """
+        fbase = f'#EXT-X-DATERANGE:ID="{self.event_id}"'
+        iso8601 = f"{datetime.datetime.utcnow().isoformat()}Z"
+        fdur = ""
+        if self.break_duration:
+            fdur = f",PLANNED-DURATION={self.break_duration}"
+
+        if self.cue_state == "OUT":
+            fstart = f',START-DATE="{iso8601}"'
+            tag = f"{fbase}{fstart}{fdur},SCTE35-OUT={self.cue.encode_as_hex()}"
+            return tag
+
+        if self.cue_state == "IN":
+            fstop = f',END-DATE="{iso8601}"'
+            tag = f"{fbase}{fstop},SCTE35-IN={self.cue.encode_as_hex()}"
+            self.event_id += 1
+            return tag
+        return False
+
+    def _splice_insert_cue_out(self, cue):
+        cmd = cue.command
+        if cmd.out_of_network_indicator:
+            if cmd.break_duration:
+                self.break_duration = cmd.break_duration
+            self.cue_state = "OUT"
+            return True
+        return False
+
+    def _time_signal_cue_out(self, cue):
+        seg_starts = [0x22, 0x30, 0x32, 0x34, 0x36, 0x44, 0x46]
+        for dsptr in cue.descriptors:
+            if dsptr.tag != 2:
+                return False
+            if dsptr.segmentation_type_id in seg_starts:
+                self.seg_type = dsptr.segmentation_type_id + 1
+                if dsptr.segmentation_duration:
+                    self.break_duration = dsptr.segmentation_duration
+                    self.cue_state = "OUT"
+                    return True
+        return False
+
+    def is_cue_out(self, cue):
+        """
+        is_cue_out checks a Cue instance
+        to see if it is a cue_out event.
+        Returns True for a cue_out event.
+        """
+        if cue is None:
+            return False
+        if self.cue_state not in ["IN", None]:
+            return False
+        cmd = cue.command
+        if cmd.command_type == 5:
+            return self._splice_insert_cue_out(cue)
+        if cmd.command_type == 6:
+            return self._time_signal_cue_out(cue)
+
+        return False
+
+    def is_cue_in(self, cue):
+        """
+        is_cue_in checks a Cue instance
+        to see if it is a cue_in event.
+        Returns True for a cue_in event.
+        """
+        if cue is None:
+            return False
+        if self.cue_state not in ["OUT", "CONT"]:
+            return False
+        cmd = cue.command
+        if cmd.command_type == 5:
+            if not cmd.out_of_network_indicator:
+                return True
+        if cmd.command_type == 6:
+            for dsptr in cue.descriptors:
+                if dsptr.tag == 2:
+                    if dsptr.segmentation_type_id == self.seg_type:
+                        self.seg_type = None
+                        self.cue_state = "IN"
+                        return True
+        return False
+
+
+class CueSchedule:
+    """
+    CueSchedule holds (insert_pts, cue) pairs
+    ordered by insert_pts, with a set for dedup.
+    """
+
+    def __init__(self):
+        self.pts = []
+        self.cues = []
+        self.seen = set()
+        self.head = 0
+        self.head_started = None
+
+    def __len__(self):
+        return len(self.pts)
+
+    def __iter__(self):
+        return zip(self.pts, self.cues)
+
+    def add(self, insert_pts, cue):
+        """
+        add inserts a (insert_pts, cue) pair in pts order,
+        returns False if the pair is already scheduled.
+        """
+        if (insert_pts, cue) in self.seen:
+            return False
+        self.seen.add((insert_pts, cue))
+        idx = bisect_right(self.pts, insert_pts)
+        self.pts.insert(idx, insert_pts)
+        self.cues.insert(idx, cue)
+        if self.head_started is not None and insert_pts < self.head_started:
+            self.head += 1
+        return True
+
+    def pop_due(self, started, next_start):
+        """
+        pop_due removes and returns the pairs
+        with started <= insert_pts < next_start.
+
+        self.head is the index of the first pair at or after started,
+        it is only looked up again when started changes,
+        so each call checks just the head pair.
+        """
+        if started != self.head_started:
+            self.head = bisect_left(self.pts, started)
+            self.head_started = started
+        due = []
+        while self.head < len(self.pts) and self.pts[self.head] < next_start:
+            pair = (self.pts.pop(self.head), self.cues.pop(self.head))
+            self.seen.discard(pair)
+            due.append(pair)
+        return due
+
+    def clear(self):
+        """
+        clear removes all scheduled cues.
+        """
+        self.pts.clear()
+        self.cues.clear()
+        self.seen.clear()
+        self.head = 0
+        self.head_started = None
+
+
+class SidecarWatcher:
+    """
+    SidecarWatcher reads new lines from a sidecar file.
+
+    Local files are checked with os.stat (inode, size, mtime)
+    and only the bytes appended since the last read are read.
+    A truncated or rewritten file is read again from the start.
+    A last line with no newline yet is held until
+    the newline is written, or until flush is called.
+    Urls are read whole and compared to the last read.
+
+    Checks are rate limited to once per segment,
+    or once every interval seconds when interval is set.
+    """
+
+    TAIL_SIZE = 64
+
+    def __init__(self, sidecar_file, interval=None):
+        self.sidecar_file = sidecar_file
+        self.interval = interval
+        self.last_check = None
+        self.last_segnum = None
+        self.key = None
+        self.offset = 0
+        self.tail = b""
+        self.partial = b""
+        self.last_lines = None
+
+    def due(self, segnum=None):
+        """
+        due returns True when it is time to check
+        the sidecar file again.
+        """
+        now = time.monotonic()
+        if self.last_check is not None:
+            if self.interval is None and segnum == self.last_segnum:
+                return False
+            if self.interval is not None and now - self.last_check < self.interval:
+                return False
+        self.last_check = now
+        self.last_segnum = segnum
+        return True
+
+    def _is_local(self):
+        return "://" not in self.sidecar_file or os.path.exists(self.sidecar_file)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.sidecar_file)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _rewritten(self, key, sidefile):
+        """
+        _rewritten returns True if the file was replaced, truncated,
+        or rewritten since the last read.
+        """
+        if self.key is None or key[0] != self.key[0] or key[1] < self.offset:
+            return True
+        if self.tail:
+            sidefile.seek(self.offset - len(self.tail))
+            return sidefile.read(len(self.tail)) != self.tail
+        return False
+
+    def _poll_local(self):
+        key = self._stat()
+        if key is None:
+            return []
+        if key == self.key:
+            return []
+        with open(self.sidecar_file, "rb") as sidefile:
+            if self._rewritten(key, sidefile):
+                self.offset = 0
+                self.tail = b""
+                self.partial = b""
+            sidefile.seek(self.offset)
+            data = sidefile.read()
+        self.key = key
+        self.offset += len(data)
+        self.tail = (self.tail + data)[-self.TAIL_SIZE :]
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return lines
+
+    def _poll_remote(self):
+        with reader(self.sidecar_file) as sidefile:
+            lines = sidefile.readlines()
+        if lines == self.last_lines:
+            return []
+        self.last_lines = lines
+        return lines
+
+    def flush(self):
+        """
+        flush returns the held last line, if there is one,
+        for a sidecar file that is done being written.
+        """
+        lines, self.partial = [self.partial], b""
+        return [line for line in lines if line]
+
+    def poll(self):
+        """
+        poll returns a list of new lines
+        from the sidecar file as bytes.
+        """
+        if self._is_local():
+            return self._poll_local()
+        return self._poll_remote()
+
+
+class SlidingWindow:
+    """
+    The SlidingWindow class
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.panes = deque()
+        self.delete = False
+        self.unlink = os.unlink
+        self.evict = None
+
+    def popleft_pane(self):
+        """
+        popleft_pane removes the first item in self.panes
+        """
+        popped = self.panes.popleft()
+        if self.evict:
+            self.evict(popped.name)
+        if self.delete and not self.referenced(popped.name):
+            try:
+                self.unlink(popped.name)
+            except FileNotFoundError:
+                pass
+
+    def referenced(self, name):
+        """
+        referenced returns True if a pane in the window
+        uses name, like a byterange media file.
+        """
+        return any(a_pane.name == name for a_pane in self.panes)
+
+    def push_pane(self, a_pane):
+        """
+        push appends a_pane to self.panes
+        """
+        self.panes.append(a_pane)
+
+    def all_panes(self):
+        """
+        all_panes returns the current window panes joined.
+        """
+        return "".join([a_pane.get() for a_pane in self.panes])
+
+    def slide_panes(self, a_pane=None):
+        """
+        slide calls self.push_pane with a_pane
+        and then calls self.popleft_pane to trim self.panes
+        as needed.
+        """
+        if a_pane:
+            self.push_pane(a_pane)
+        if len(self.panes) > self.size:
+            self.popleft_pane()
+
+
+class Reaper:
+    """
+    Reaper deletes segments that left the sliding window.
+
+    Segments are kept for grace seconds after they are added,
+    players with an older playlist can still get them.
+    A background thread deletes what is due in batches,
+    at most once every interval seconds.
+    A failed delete is tried again, interval seconds later,
+    up to retries times, then counted as a failure.
+    A file already gone is counted as missing.
+    """
+
+    # seg12.ts, seg12.3.ts LL-HLS parts, media12.ts byteranges, and .tmp files
+    ORPHAN = re.compile(r"^(?:seg|media)(\d+)(\.\d+)?\.ts(\.tmp)?$")
+    # .x9k3-PID-N.ts.tmp file segment buffers
+    BUFFER = re.compile(r"^\.x9k3-(\d+)-\d+\.ts\.tmp$")
+
+    def __init__(self, grace=0, interval=1.0, retries=3):
+        self.grace = grace
+        self.interval = interval
+        self.retries = retries
+        self.pending = []
+        self.cond = threading.Condition()
+        self.thread = None
+        self.closing = False
+        self.deleted = 0
+        self.missing = 0
+        self.failures = 0
+        self.batches = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def start(self):
+        """
+        start starts the background reaper thread.
+        """
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, seg_name, tries=0):
+        """
+        add schedules deleting seg_name in grace seconds,
+        or in interval seconds for a retry.
+        """
+        due = time.monotonic() + (self.interval if tries else self.grace)
+        with self.cond:
+            heapq.heappush(self.pending, (due, seg_name, tries))
+            self.cond.notify_all()
+
+    def _due(self, now):
+        with self.cond:
+            batch = []
+            while self.pending and self.pending[0][0] <= now:
+                batch.append(heapq.heappop(self.pending))
+            return batch
+
+    def _delete(self, seg_name, tries):
+        try:
+            os.unlink(seg_name)
+            self.deleted += 1
+        except FileNotFoundError:
+            self.missing += 1
+        except OSError as err:
+            if tries < self.retries:
+                self.add(seg_name, tries + 1)
+                return
+            self.failures += 1
+            print2(f"reaper can not delete {seg_name}: {err}")
+
+    def reap(self, now=None):
+        """
+        reap deletes the segments that are due.
+        """
+        batch = self._due(time.monotonic() if now is None else now)
+        if batch:
+            self.batches += 1
+        for _, seg_name, tries in batch:
+            self._delete(seg_name, tries)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closing:
+                    wait = self.pending[0][0] - time.monotonic() if self.pending else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                if self.closing:
+                    return
+            self.reap()
+            with self.cond:
+                self.cond.wait_for(lambda: self.closing, self.interval)
+
+    def stats(self):
+        """
+        stats returns pending, deleted, missing,
+        failures and batches counts.
+        """
+        return {
+            "pending": len(self),
+            "deleted": self.deleted,
+            "missing": self.missing,
+            "failures": self.failures,
+            "batches": self.batches,
+        }
+
+    def stop(self):
+        """
+        stop stops the background thread,
+        pending deletes are kept.
+        """
+        if self.thread:
+            with self.cond:
+                self.closing = True
+                self.cond.notify_all()
+            self.thread.join()
+            self.thread = None
+
+    def follow(self, reaper):
+        """
+        follow takes over the pending deletes of reaper,
+        for a new X9K3 instance on the same output,
+        so they still get their grace.
+        """
+        reaper.stop()
+        with self.cond:
+            for item in reaper.pending:
+                heapq.heappush(self.pending, item)
+            reaper.pending = []
+            self.cond.notify_all()
+        self.deleted += reaper.deleted
+        self.missing += reaper.missing
+        self.failures += reaper.failures
+        self.batches += reaper.batches
+
+    def close(self):
+        """
+        close stops the background thread and deletes
+        everything pending right away, grace or not.
+        """
+        self.stop()
+        for _ in range(self.retries + 1):
+            if not self.pending:
+                break
+            self.reap(float("inf"))
+
+
+class PlaylistWriter:
+    """
+    PlaylistWriter writes the index.m3u8.
+
+    When not live, and the header is unchanged and only one
+    pane has been added since the last write, the new pane
+    is appended to the file.
+    Otherwise the whole playlist is written to a temp file
+    and moved into place with os.replace, so a reader
+    never sees a half written playlist.
+    """
+
+    def __init__(self):
+        self.header = None
+        self.last_pane = None
+        self.count = 0
+
+    def _can_append(self, m3u8uri, header, panes, live):
+        if live or header != self.header or len(panes) < 2:
+            return False
+        if len(panes) != self.count + 1 or panes[-2] is not self.last_pane:
+            return False
+        return os.path.exists(m3u8uri)
+
+    @staticmethod
+    def replace(m3u8uri, text):
+        """
+        replace atomically replaces m3u8uri with text.
+        """
+        tmp_uri = f"{m3u8uri}.tmp"
+        with open(tmp_uri, "w", encoding="utf8") as m3u8:
+            m3u8.write(text)
+        os.replace(tmp_uri, m3u8uri)
+
+    def write(self, m3u8uri, header, panes, live=False):
+        """
+        write writes header and panes to m3u8uri.
+        """
+        if self._can_append(m3u8uri, header, panes, live):
+            with open(m3u8uri, "a", encoding="utf8") as m3u8:
+                m3u8.write(panes[-1].get())
+        else:
+            self.replace(m3u8uri, header + "".join([a_pane.get() for a_pane in panes]))
+        self.header = header
+        self.last_pane = panes[-1] if panes else None
+        self.count = len(panes)
+
+
+class Checkpoint:
+    """
+    Checkpoint saves X9K3 state next to the index.m3u8,
+    so an instance can resume without parsing the playlist.
+
+        index.m3u8.state    segnum, media and discontinuity sequence,
+                            SCTE35 cue state and pending sidecar cues,
+                            as JSON, rewritten with os.replace.
+        index.m3u8.panes    one JSON line per segment in the window,
+                            appended, and rewritten with os.replace
+                            when it is twice the window size.
+
+    Pane lines with a num at or past the saved segnum are ignored
+    when loading, so a crash between the two writes is harmless.
+    """
+
+    def __init__(self, m3u8uri):
+        self.state_uri = f"{m3u8uri}.state"
+        self.panes_uri = f"{m3u8uri}.panes"
+        self.lines = None
+
+    def exists(self):
+        """
+        exists returns True if there is a saved state.
+        """
+        return os.path.exists(self.state_uri) and os.path.exists(self.panes_uri)
+
+    @staticmethod
+    def _pane_line(pane):
+        return json.dumps([pane.file, pane.name, pane.num, pane.tags]) + "\n"
+
+    def _compact(self, panes):
+        PlaylistWriter.replace(
+            self.panes_uri, "".join([self._pane_line(pane) for pane in panes])
+        )
+        self.lines = len(panes)
+
+    def write(self, state, panes, size):
+        """
+        write saves state and the newest of panes,
+        panes should be a snapshot of the window panes.
+        """
+        if self.lines is None or self.lines >= size * 2:
+            self._compact(panes)
+        elif panes:
+            with open(self.panes_uri, "a", encoding="utf8") as journal:
+                journal.write(self._pane_line(panes[-1]))
+            self.lines += 1
+        PlaylistWriter.replace(self.state_uri, json.dumps(state))
+
+    def load(self, size=None):
+        """
+        load returns the saved state, and the newest size
+        saved panes as a list of Chunks in order.
+        Older journal lines are panes that already left the window.
+        """
+        with open(self.state_uri, encoding="utf8") as state_file:
+            state = json.load(state_file)
+        panes = {}
+        self.lines = 0
+        with open(self.panes_uri, encoding="utf8") as journal:
+            for line in journal:
+                self.lines += 1
+                try:
+                    file, name, num, tags = json.loads(line)
+                except ValueError:
+                    continue
+                if num < state["segnum"]:
+                    chunk = Chunk(file, name, num)
+                    chunk.tags = tags
+                    panes[num] = chunk
+        chunks = [panes[num] for num in sorted(panes)]
+        if size:
+            chunks = chunks[-size:]
+        return state, chunks
+
+
+class PtsIndex:
+    """
+    PtsIndex is a compact binary index of keyframes,
+    segments and SCTE-35 cues, written next to
+    the index.m3u8 as index.m3u8.idx, so recordings
+    can be trimmed without parsing the media.
+
+    Each record is 24 bytes, little endian.
+
+        kind    u8      START, KEYFRAME, SEGMENT, or CUE
+        aux     u32     segment number for START and SEGMENT,
+                        splice command type for CUE
+        pts     u64     90k ticks
+        offset  u64     input byte offset from the first sync byte
+
+    A START record begins each run, a continued index.m3u8
+    appends a run. Records are in stream order,
+    so load and seek bisect the newest run.
+    """
+
+    RECORD = struct.Struct("<B3xIQQ")
+    START, KEYFRAME, SEGMENT, CUE = range(4)
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.file = None
+        self.kinds = {}
+
+    def open(self, segnum=0, append=False):
+        """
+        open starts a run, appending to the index when append is set.
+        """
+        self.file = open(self.uri, "ab" if append else "wb")
+        self.add(self.START, 0, 0, segnum)
+
+    def add(self, kind, pts, offset, aux=0):
+        """
+        add writes a record, pts is in seconds.
+        A SEGMENT record flushes the index.
+        """
+        self.file.write(self.RECORD.pack(kind, aux, round(pts * 90000), offset))
+        if kind == self.SEGMENT:
+            self.file.flush()
+
+    def close(self):
+        """
+        close closes the index file.
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def load(self):
+        """
+        load reads the newest run of the index for seek.
+        """
+        with open(self.uri, "rb") as idx:
+            data = idx.read()
+        whole = len(data) - len(data) % self.RECORD.size
+        for kind, aux, pts, offset in self.RECORD.iter_unpack(data[:whole]):
+            if kind == self.START:
+                self.kinds = {}
+                continue
+            ptss, rest = self.kinds.setdefault(kind, ([], []))
+            ptss.append(pts)
+            rest.append((offset, aux))
+        return self
+
+    def seek(self, pts, kind=KEYFRAME):
+        """
+        seek returns (pts, offset, aux) of the last record
+        of kind at or before pts, in seconds, or None.
+        """
+        ptss, rest = self.kinds.get(kind, ([], []))
+        idx = bisect_right(ptss, round(pts * 90000)) - 1
+        if idx < 0:
+            return None
+        offset, aux = rest[idx]
+        return ptss[idx] / 90000, offset, aux
+
+
+class IndexCache:
+    """
+    IndexCache keeps scans of VOD inputs in cache_dir,
+    the keyframe and SCTE-35 cue pts and byte offsets,
+    so a file can be segmented again at another segment time,
+    or with other sidecar cues, without parsing it.
+
+    Scans are keyed by the input's size, mtime,
+    and a hash of it's first and last SAMPLE bytes.
+    """
+
+    SAMPLE = 1 << 20
+    VERSION = 1
+
+    def __init__(self, cache_dir, path, shulga=False):
+        self.cache_dir = cache_dir
+        self.path = path
+        self.shulga = shulga
+        self.uri = None
+
+    def key(self):
+        """
+        key returns the cache key of the input.
+        """
+        import hashlib  # pylint: disable=import-outside-toplevel
+
+        stat = os.stat(self.path)
+        digest = hashlib.sha1(
+            f"{self.VERSION} {stat.st_size} {stat.st_mtime_ns} {self.shulga}".encode()
+        )
+        with open(self.path, "rb") as media:
+            digest.update(media.read(self.SAMPLE))
+            if stat.st_size > self.SAMPLE:
+                media.seek(max(stat.st_size - self.SAMPLE, self.SAMPLE))
+                digest.update(media.read())
+        return digest.hexdigest()
+
+    def load(self):
+        """
+        load returns the cached scan of the input, or None.
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.uri = X9K3.mk_uri(self.cache_dir, f"{self.key()}.json")
+        try:
+            with open(self.uri, encoding="utf8") as cached:
+                return json.load(cached)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, scan, end):
+        """
+        save caches scan, end is the number of bytes parsed.
+        """
+        if scan["start"] is None:
+            return
+        scan["end"] = end
+        scan["skip"] = os.path.getsize(self.path) - end
+        PlaylistWriter.replace(self.uri, json.dumps(scan))
+
+
+class RangeSegment:
+    """
+    RangeSegment is a segment buffer for a byte range
+    of a local file, saved with os.copy_file_range,
+    or os.sendfile, so the bytes aren't copied through Python.
+    """
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+
+    def tell(self):
+        """
+        tell returns the size of the range.
+        """
+        return self.end - self.start
+
+    def read(self, start):
+        """
+        read returns the bytes of the range after start.
+        """
+        with open(self.path, "rb") as media:
+            media.seek(self.start + start)
+            return media.read(self.end - self.start - start)
+
+    def getvalue(self):
+        """
+        getvalue returns the bytes of the range.
+        """
+        return self.read(0)
+
+    def _copy(self, src, dst):
+        offset = self.start
+        left = self.tell()
+        while left > 0:
+            if hasattr(os, "copy_file_range"):
+                sent = os.copy_file_range(src.fileno(), dst.fileno(), left, offset)
+            else:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, left)
+            if not sent:
+                break
+            offset += sent
+            left -= sent
+
+    def save(self, seg_name):
+        """
+        save copies the range to seg_name.
+        """
+        tmp_name = f"{seg_name}.tmp"
+        with open(self.path, "rb") as src, open(tmp_name, "wb") as dst:
+            try:
+                self._copy(src, dst)
+            except OSError:
+                dst.seek(0)
+                dst.truncate()
+                dst.write(self.getvalue())
+        os.replace(tmp_name, seg_name)
+
+    def discard(self):
+        """
+        discard does nothing, the input is not changed.
+        """
+
+
+class MappedSegment:
+    """
+    MappedSegment is a segment buffer for mmap input.
+    Every packet of the mapping is written in order,
+    so a write only moves the end of the segment,
+    and the segment is saved from a slice of the mapping.
+    """
+
+    def __init__(self, pool, start):
+        self.pool = pool
+        self.start = start
+        self.end = start
+
+    def write(self, data):
+        """
+        write moves the end of the segment past data.
+        """
+        self.end += len(data)
+        self.pool.pos = self.end
+
+    def tell(self):
+        """
+        tell returns the number of bytes written.
+        """
+        return self.end - self.start
+
+    def getbuffer(self):
+        """
+        getbuffer returns a memoryview of the segment in the mapping.
+        """
+        return memoryview(self.pool.mapping)[self.start : self.end]
+
+    def getvalue(self):
+        """
+        getvalue returns a copy of the segment.
+        """
+        return self.pool.mapping[self.start : self.end]
+
+    def read(self, start):
+        """
+        read returns a copy of the bytes written after start.
+        """
+        return self.pool.mapping[self.start + start : self.end]
+
+    def save(self, seg_name):
+        """
+        save writes the segment to seg_name.
+        """
+        tmp_name = f"{seg_name}.tmp"
+        with open(tmp_name, "wb") as seg:
+            with self.getbuffer() as data:
+                seg.write(data)
+        os.replace(tmp_name, seg_name)
+
+    def discard(self):
+        """
+        discard does nothing, the mapping is read only.
+        """
+
+
+class PooledSegment:
+    """
+    PooledSegment is a segment buffer backed by a
+    reusable bytearray from a SegmentBuffers pool.
+    """
+
+    def __init__(self, pool, buf):
+        self.pool = pool
+        self.buf = buf
+        self.size = 0
+
+    def write(self, data):
+        """
+        write copies data into the buffer,
+        growing it only if it is too small.
+        """
+        end = self.size + len(data)
+        if end > len(self.buf):
+            del self.buf[self.size :]
+            self.buf += data
+        else:
+            self.buf[self.size : end] = data
+        self.size = end
+
+    def tell(self):
+        """
+        tell returns the number of bytes written.
+        """
+        return self.size
+
+    def getbuffer(self):
+        """
+        getbuffer returns a memoryview of the bytes written.
+        """
+        return memoryview(self.buf)[: self.size]
+
+    def getvalue(self):
+        """
+        getvalue returns a copy of the bytes written.
+        """
+        return bytes(self.buf[: self.size])
+
+    def read(self, start):
+        """
+        read returns a copy of the bytes written after start.
+        """
+        return bytes(self.buf[start : self.size])
+
+    def save(self, seg_name):
+        """
+        save writes the segment to seg_name
+        and returns the buffer to the pool.
+        """
+        tmp_name = f"{seg_name}.tmp"
+        with open(tmp_name, "wb") as seg:
+            with self.getbuffer() as data:
+                seg.write(data)
+        os.replace(tmp_name, seg_name)
+        self.discard()
+
+    def discard(self):
+        """
+        discard returns the buffer to the pool.
+        """
+        self.pool.release(self.buf, self.size)
+        self.buf = None
+
+
+class FileSegment:
+    """
+    FileSegment is a write through segment buffer,
+    packets are written straight to a temp file
+    that is renamed to the segment name at the cut point.
+    """
+
+    BUFFER_SIZE = 65536
+
+    def __init__(self, tmp_name):
+        self.tmp_name = tmp_name
+        self.file = open(tmp_name, "wb", buffering=self.BUFFER_SIZE)
+        self.size = 0
+
+    def write(self, data):
+        """
+        write writes data to the temp file.
+        """
+        self.file.write(data)
+        self.size += len(data)
+
+    def tell(self):
+        """
+        tell returns the number of bytes written.
+        """
+        return self.size
+
+    def getvalue(self):
+        """
+        getvalue reads back the bytes written.
+        """
+        self.file.flush()
+        with open(self.tmp_name, "rb") as tmp:
+            return tmp.read()
+
+    def read(self, start):
+        """
+        read reads back the bytes written after start.
+        """
+        self.file.flush()
+        with open(self.tmp_name, "rb") as tmp:
+            tmp.seek(start)
+            return tmp.read()
+
+    def save(self, seg_name):
+        """
+        save renames the temp file to seg_name.
+        """
+        self.file.close()
+        os.replace(self.tmp_name, seg_name)
+
+    def discard(self):
+        """
+        discard closes and removes the temp file.
+        """
+        self.file.close()
+        try:
+            os.unlink(self.tmp_name)
+        except FileNotFoundError:
+            pass
+
+
+class SegmentBuffers:
+    """
+    SegmentBuffers makes the active segment buffer.
+    When mapping is set to a mmap of the input,
+    MappedSegments are made whatever the mode.
+
+    modes:
+        memory  a new io.BytesIO per segment.
+        pool    reusable bytearrays, preallocated to
+                the largest segment size seen so far.
+        file    write through to a temp file in tmp_dir.
+    """
+
+    MODES = ["memory", "pool", "file"]
+    HEADROOM = 1.25
+
+    def __init__(self, mode="memory", tmp_dir=".", keep=4):
+        self.mode = mode
+        self.tmp_dir = tmp_dir
+        self.keep = keep
+        self.free = deque()
+        self.capacity = 0
+        self.count = 0
+        self.mapping = None
+        self.pos = 0
+
+    def new(self):
+        """
+        new returns a new active segment buffer.
+        """
+        if self.mapping is not None:
+            return MappedSegment(self, self.pos)
+        if self.mode == "pool":
+            if self.free:
+                buf = self.free.pop()
+            else:
+                buf = bytearray(self.capacity)
+            return PooledSegment(self, buf)
+        if self.mode == "file":
+            self.count += 1
+            tmp_file = f".x9k3-{os.getpid()}-{self.count}.ts.tmp"
+            return FileSegment(X9K3.mk_uri(self.tmp_dir, tmp_file))
+        return io.BytesIO()
+
+    def release(self, buf, size):
+        """
+        release returns a bytearray to the pool
+        and grows the preallocation size
+        from the observed segment size.
+        """
+        wanted = int(size * self.HEADROOM)
+        if wanted > self.capacity:
+            self.capacity = wanted
+        if len(buf) < self.capacity:
+            buf.extend(bytes(self.capacity - len(buf)))
+        if len(self.free) < self.keep:
+            self.free.append(buf)
+
+    def close(self):
+        """
+        close closes the mapping, and it's file descriptor.
+        """
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    @staticmethod
+    def discard(segment):
+        """
+        discard releases a segment buffer that won't be saved.
+        """
+        if hasattr(segment, "discard"):
+            segment.discard()
+
+    @staticmethod
+    def read(segment, start):
+        """
+        read returns a copy of the bytes written
+        to a segment buffer after start.
+        """
+        if isinstance(segment, io.BytesIO):
+            with segment.getbuffer() as view:
+                return bytes(view[start:])
+        return segment.read(start)
+
+
+class SegmentWriter:
+    """
+    SegmentWriter writes segments and playlists in order.
+
+    With maxsize 0, writes happen on the parsing thread.
+    Call start to write from a background thread
+    fed by a queue of up to maxsize jobs.
+
+    Segments are written to a temp file and renamed,
+    so the playlist never references a missing or partial segment.
+
+    When store is set to a MemoryStore, segments and playlists
+    are also put in the store, and disk can be set to False
+    to only keep them in memory.
+
+    When the queue is full, policy is one of:
+        block   wait for room.
+        drop    discard stale playlists still in the queue,
+                then wait for room if needed.
+                Segments are never dropped.
+        alarm   print a warning, then wait for room.
+    """
+
+    POLICIES = ["block", "drop", "alarm"]
+
+    def __init__(self, maxsize=0, policy="block"):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.playlist = PlaylistWriter()
+        self.store = None
+        self.disk = True
+        self.kept = {}
+        self.unlink = os.unlink
+        self.jobs = deque()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.error = None
+        self.writes = 0
+        self.dropped = 0
+        self.alarms = 0
+        self.max_depth = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def start(self):
+        """
+        start starts the background writer thread.
+        """
+        if self.policy not in self.POLICIES:
+            raise ValueError(f"writer policy must be in {self.POLICIES}")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def depth(self):
+        """
+        depth returns the number of queued jobs.
+        """
+        return len(self.jobs)
+
+    def stats(self):
+        """
+        stats returns queue depth and write latency stats.
+        """
+        avg = self.total_latency / self.writes if self.writes else 0.0
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "writes": self.writes,
+            "dropped": self.dropped,
+            "alarms": self.alarms,
+            "last_latency": round(self.last_latency, 6),
+            "avg_latency": round(avg, 6),
+            "max_latency": round(self.max_latency, 6),
+        }
+
+    def _segment(self, seg_name, data):
+        if self.store is not None:
+            value = data if isinstance(data, bytes) else data.getvalue()
+            self.store.put(seg_name, value)
+            if not self.disk:
+                SegmentBuffers.discard(data)
+                return
+        if hasattr(data, "save"):
+            data.save(seg_name)
+            return
+        if isinstance(data, io.BytesIO):
+            data = data.getbuffer()
+        tmp_name = f"{seg_name}.tmp"
+        with open(tmp_name, "wb") as seg:
+            seg.write(data)
+        os.replace(tmp_name, seg_name)
+
+    def _playlist(self, m3u8uri, header, panes, live, position=None):
+        if self.disk:
+            self.playlist.write(m3u8uri, header, panes, live)
+        if self.store is not None:
+            self.store.put(
+                m3u8uri, header + "".join([a_pane.get() for a_pane in panes]), position
+            )
+
+    @staticmethod
+    def _append(media_name, data, offset):
+        value = data if isinstance(data, bytes) else SegmentBuffers.read(data, 0)
+        SegmentBuffers.discard(data)
+        with open(media_name, "r+b" if offset else "wb") as media:
+            media.seek(offset)
+            media.write(value)
+
+    @staticmethod
+    def _link(src, dst):
+        tmp_name = f"{dst}.tmp"
+        try:
+            os.link(src, tmp_name)
+        except OSError:
+            shutil.copyfile(src, tmp_name)
+        os.replace(tmp_name, dst)
+
+    def _keep(self, seg_name, kept):
+        if self.disk:
+            self._link(seg_name, kept)
+        else:
+            self.kept[kept] = self.store.get(self.store.key(seg_name))
+
+    def _republish(self, kept, seg_name):
+        if self.disk:
+            self._link(kept, seg_name)
+        if self.store is not None:
+            data = self.kept.get(kept)
+            if data is None:
+                with open(kept, "rb") as kept_file:
+                    data = kept_file.read()
+            self.store.put(seg_name, data)
+
+    def _discard(self, seg_name):
+        if self.store is not None:
+            self.store.discard(seg_name)
+        if self.disk:
+            try:
+                os.unlink(seg_name)
+            except FileNotFoundError:
+                pass
+
+    def _do(self, job):
+        began = time.monotonic()
+        func, args = job
+        func(*args)
+        self.last_latency = time.monotonic() - began
+        self.max_latency = max(self.max_latency, self.last_latency)
+        self.total_latency += self.last_latency
+        self.writes += 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.jobs:
+                    self.cond.wait()
+                job = self.jobs[0]
+            if job is None:
+                return
+            try:
+                self._do(job)
+            except Exception as err:  # pylint: disable=broad-except
+                self.error = err
+            with self.cond:
+                self.jobs.popleft()
+                self.cond.notify_all()
+
+    def _chk_error(self):
+        if self.error:
+            err, self.error = self.error, None
+            raise err
+
+    def _full(self):
+        if self.policy == "drop":
+            stale = [
+                job
+                for job in list(self.jobs)[1:]
+                if job and job[0] == self._playlist
+            ]
+            for job in stale:
+                self.jobs.remove(job)
+                self.dropped += 1
+        if self.policy == "alarm":
+            self.alarms += 1
+            print2(
+                f"segment writer queue full: {self.depth()} jobs,"
+                f" last write {self.last_latency:.3f}s"
+            )
+
+    def _put(self, job):
+        if not self.thread:
+            self._do(job)
+            return
+        self._chk_error()
+        with self.cond:
+            if len(self.jobs) >= self.maxsize:
+                self._full()
+            while len(self.jobs) >= self.maxsize:
+                self.cond.wait()
+            self.jobs.append(job)
+            self.max_depth = max(self.max_depth, len(self.jobs))
+            self.cond.notify_all()
+
+    def write_segment(self, seg_name, data):
+        """
+        write_segment queues data to be written to seg_name.
+        data is bytes, or a io.BytesIO or segment buffer
+        that is no longer written to.
+        """
+        self._put((self._segment, (seg_name, data)))
+
+    def append_segment(self, media_name, data, offset):
+        """
+        append_segment queues writing data at offset in media_name,
+        a rolling media file of byterange segments.
+        A media file is started over at offset 0.
+        """
+        self._put((self._append, (media_name, data, offset)))
+
+    def keep(self, seg_name, kept):
+        """
+        keep queues keeping seg_name as kept, a hard link or copy,
+        after the queued write of it. Without disk,
+        the bytes in the store are kept in memory.
+        """
+        self._put((self._keep, (seg_name, kept)))
+
+    def republish(self, kept, seg_name):
+        """
+        republish queues publishing a kept segment as seg_name.
+        """
+        self._put((self._republish, (kept, seg_name)))
+
+    def write_playlist(self, m3u8uri, header, panes, live=False, position=None):
+        """
+        write_playlist queues a playlist write,
+        panes should be a snapshot of the window panes.
+        position is passed to the store for LL-HLS
+        blocking playlist reloads.
+        """
+        self._put((self._playlist, (m3u8uri, header, panes, live, position)))
+
+    def write_checkpoint(self, checkpoint, state, panes, size):
+        """
+        write_checkpoint queues a Checkpoint write,
+        after the segment and playlist writes before it.
+        """
+        self._put((checkpoint.write, (state, panes, size)))
+
+    def retire(self, seg_name):
+        """
+        retire queues retiring seg_name from the store,
+        after any queued write of it.
+        """
+        if self.store is not None:
+            self._put((self.store.retire, (seg_name,)))
+
+    def remove(self, seg_name):
+        """
+        remove queues deleting seg_name with unlink,
+        after any queued write of it.
+        """
+        self._put((self.unlink, (seg_name,)))
+
+    def discard(self, seg_name):
+        """
+        discard queues removing seg_name from disk
+        and the store, after any queued write of it.
+        """
+        self._put((self._discard, (seg_name,)))
+
+    def close(self):
+        """
+        close waits for queued jobs to be written
+        and stops the background thread.
+        """
+        if self.thread:
+            with self.cond:
+                self.jobs.append(None)
+                self.cond.notify_all()
+            self.thread.join()
+            self.thread = None
+            self.jobs.clear()
+            print2(f"segment writer: {self.stats()}")
+        self._chk_error()
+
+
+class MemoryStore:
+    """
+    MemoryStore holds segments and playlists
+    in memory for an OriginServer, keyed by file name.
+
+    Retired segments are kept until linger more
+    segments are retired, so players with an older
+    playlist can still get them.
+
+    A LL-HLS playlist is put with it's position,
+    (last whole segment, segment being cut, last part),
+    so requests can wait for a segment or part.
+    """
+
+    PART = re.compile(r"seg(\d+)\.(\d+)\.ts")
+
+    def __init__(self, linger=5):
+        self.linger = linger
+        self.entries = {}
+        self.positions = {}
+        self.retired = deque()
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(uri):
+        """
+        key returns the file name of uri
+        """
+        return uri.replace("\\", "/").rsplit("/", 1)[-1]
+
+    def put(self, uri, data, position=None):
+        """
+        put stores data, bytes or str, for uri.
+        """
+        if isinstance(data, str):
+            data = data.encode()
+        with self.cond:
+            self.entries[self.key(uri)] = data
+            if position is not None:
+                self.positions[self.key(uri)] = position
+                self.cond.notify_all()
+
+    def get(self, name):
+        """
+        get returns the bytes stored for name, or None.
+        """
+        return self.entries.get(name)
+
+    def append(self, uri, text):
+        """
+        append appends text to the entry for uri.
+        """
+        self.put(uri, (self.get(self.key(uri)) or b"") + text.encode())
+
+    def retire(self, uri):
+        """
+        retire marks uri as out of the window
+        and drops the oldest retired entries.
+        """
+        with self.cond:
+            self.retired.append(self.key(uri))
+            while len(self.retired) > self.linger:
+                self.entries.pop(self.retired.popleft(), None)
+
+    def discard(self, uri):
+        """
+        discard drops uri right away.
+        """
+        self.entries.pop(self.key(uri), None)
+
+    def ready(self, name, msn, part=None):
+        """
+        ready returns True when the playlist name
+        has segment msn, or part of segment msn.
+        """
+        done, current, last_part = self.positions[name]
+        if done >= msn:
+            return True
+        return part is not None and current == msn and last_part >= part
+
+    def wait(self, name, msn, part=None, timeout=None):
         """
-        #EXT-X-DATERANGE
+        wait waits up to timeout seconds for
+        ready(name, msn, part), and returns it.
         """
-        fbase = f'#EXT-X-DATERANGE:ID="{self.event_id}"'
-        iso8601 = f"{datetime.datetime.utcnow().isoformat()}Z"
-        fdur = ""
-        if self.break_duration:
-            fdur = f",PLANNED-DURATION={self.break_duration}"
+        with self.cond:
+            return self.cond.wait_for(lambda: self.ready(name, msn, part), timeout)
 
-        if self.cue_state == "OUT":
-            fstart = f',START-DATE="{iso8601}"'
-            tag = f"{fbase}{fstart}{fdur},SCTE35-OUT={self.cue.encode_as_hex()}"
-            return tag
+    def coming(self, name):
+        """
+        coming returns True if name is a part that is not cut yet,
+        like the one in #EXT-X-PRELOAD-HINT, at most
+        one segment past a playlist's segment being cut.
+        """
+        match = self.PART.fullmatch(name)
+        if not match or name in self.entries:
+            return False
+        num, part = int(match.group(1)), int(match.group(2))
+        return any(
+            (current, last_part) < (num, part) and num <= current + 1
+            for _, current, last_part in self.positions.values()
+        )
 
-        if self.cue_state == "IN":
-            fstop = f',END-DATE="{iso8601}"'
-            tag = f"{fbase}{fstop},SCTE35-IN={self.cue.encode_as_hex()}"
-            self.event_id += 1
-            return tag
-        return False
+    def wait_part(self, name, timeout=None):
+        """
+        wait_part waits up to timeout seconds while name
+        is coming, and returns False if it still is.
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.coming(name), timeout)
 
-    def _splice_insert_cue_out(self, cue):
-        cmd = cue.command
-        if cmd.out_of_network_indicator:
-            if cmd.break_duration:
-                self.break_duration = cmd.break_duration
-            self.cue_state = "OUT"
-            return True
-        return False
 
-    def _time_signal_cue_out(self, cue):
-        seg_starts = [0x22, 0x30, 0x32, 0x34, 0x36, 0x44, 0x46]
-        for dsptr in cue.descriptors:
-            if dsptr.tag != 2:
-                return False
-            if dsptr.segmentation_type_id in seg_starts:
-                self.seg_type = dsptr.segmentation_type_id + 1
-                if dsptr.segmentation_duration:
-                    self.break_duration = dsptr.segmentation_duration
-                    self.cue_state = "OUT"
+class OriginServer:
+    """
+    OriginServer serves a MemoryStore over HTTP/1.1
+    with keep-alive, from a thread per connection.
+
+    LL-HLS playlist requests with _HLS_msn, and _HLS_part,
+    are held up to hold seconds until the playlist
+    has that segment or part. Requests for a part
+    that is not cut yet, the preload hint, are held
+    up to hold seconds until it is.
+    """
+
+    TYPES = {
+        ".m3u8": ("application/vnd.apple.mpegurl", "no-cache"),
+        ".ts": ("video/mp2t", "max-age=60"),
+    }
+
+    def __init__(self, store, host="0.0.0.0", port=8080):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.hold = 6
+        self.server = None
+
+    def _handler(self):
+        from http import server  # pylint: disable=import-outside-toplevel
+        from urllib import parse  # pylint: disable=import-outside-toplevel
+
+        origin = self
+
+        class Handler(server.BaseHTTPRequestHandler):
+            """
+            Handler serves index.m3u8 and segments
+            """
+
+            protocol_version = "HTTP/1.1"
+
+            def _block(self, name, query):
+                """
+                _block holds a blocking playlist reload,
+                returns False when an error was sent.
+                """
+                if name not in origin.store.positions:
                     return True
-        return False
+                query = parse.parse_qs(query)
+                try:
+                    msn = int(query["_HLS_msn"][0])
+                    part = int(query["_HLS_part"][0]) if "_HLS_part" in query else None
+                except (KeyError, IndexError, ValueError):
+                    self.send_error(400)
+                    return False
+                if msn > origin.store.positions[name][1] + 2:
+                    self.send_error(400)
+                    return False
+                if not origin.store.wait(name, msn, part, origin.hold):
+                    self.send_error(503)
+                    return False
+                return True
 
-    def is_cue_out(self, cue):
+            def _send(self, body=True):
+                name, _, query = self.path.partition("?")
+                name = name.lstrip("/")
+                if "_HLS_msn" in query and not self._block(name, query):
+                    return
+                data = origin.store.get(name)
+                if data is None:
+                    if not origin.store.wait_part(name, origin.hold):
+                        self.send_error(503)
+                        return
+                    data = origin.store.get(name)
+                if data is None:
+                    self.send_error(404)
+                    return
+                ext = os.path.splitext(name)[1]
+                mime, cache = origin.TYPES.get(ext, ("application/octet-stream", "no-cache"))
+                self.send_response(200)
+                self.send_header("Content-Type", mime)
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", cache)
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                do_GET sends a playlist or segment
+                """
+                self._send()
+
+            def do_HEAD(self):  # pylint: disable=invalid-name
+                """
+                do_HEAD sends just the headers
+                """
+                self._send(body=False)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        return server, Handler
+
+    def start(self):
         """
-        is_cue_out checks a Cue instance
-        to see if it is a cue_out event.
-        Returns True for a cue_out event.
+        start starts serving from a background thread.
         """
-        if cue is None:
-            return False
-        if self.cue_state not in ["IN", None]:
-            return False
-        cmd = cue.command
-        if cmd.command_type == 5:
-            return self._splice_insert_cue_out(cue)
-        if cmd.command_type == 6:
-            return self._time_signal_cue_out(cue)
+        import socketserver  # pylint: disable=import-outside-toplevel
 
-        return False
+        server, handler = self._handler()
 
-    def is_cue_in(self, cue):
+        class Server(socketserver.ThreadingMixIn, server.HTTPServer):
+            """
+            Server is a threaded HTTPServer
+            """
+
+            daemon_threads = True
+
+        self.server = Server((self.host, self.port), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print2(f"serving http://{self.host}:{self.port}/index.m3u8")
+
+    def close(self):
         """
-        is_cue_in checks a Cue instance
-        to see if it is a cue_in event.
-        Returns True for a cue_in event.
+        close stops the server.
         """
-        if cue is None:
-            return False
-        if self.cue_state not in ["OUT", "CONT"]:
-            return False
-        cmd = cue.command
-        if cmd.command_type == 5:
-            if not cmd.out_of_network_indicator:
-                return True
-        if cmd.command_type == 6:
-            for dsptr in cue.descriptors:
-                if dsptr.tag == 2:
-                    if dsptr.segmentation_type_id == self.seg_type:
-                        self.seg_type = None
-                        self.cue_state = "IN"
-                        return True
-        return False
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
 
 
-class SlidingWindow:
+class Histogram:
     """
-    The SlidingWindow class
+    Histogram counts latencies in seconds
+    into Prometheus style buckets.
     """
 
-    def __init__(self, size=10000):
-        self.size = size
-        self.panes = deque()
-        self.delete = False
+    BUCKETS = (
+        0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+        0.01, 0.05, 0.1, 0.5, 1.0, 5.0,
+    )  # fmt: skip
 
-    def popleft_pane(self):
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, secs):
         """
-        popleft_pane removes the first item in self.panes
+        observe adds secs to the histogram.
         """
-        popped = self.panes.popleft()
-        if self.delete:
+        self.counts[bisect_left(self.BUCKETS, secs)] += 1
+        self.total += secs
+        self.count += 1
+
+    def lines(self, name, labels):
+        """
+        lines returns the histogram in Prometheus text format.
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Metrics times the hot path stages of a X9K3 instance
+    and reports them with gauges in Prometheus text format,
+    over http on 127.0.0.1 and/or in a stats file.
+
+    Stages are timed by wrapping the instance methods,
+    so nothing is timed or counted unless Metrics is used.
+    """
+
+    STAGES = {
+        "iframer_parse": ("iframer", "parse"),
+        "load_sidecar": (None, "_load_sidecar"),
+        "segment_write": ("writer", "_segment"),
+        "write_m3u8": (None, "_write_m3u8"),
+        "throttle": ("timer", "throttle"),
+    }
+    STATS_SECS = 5
+
+    def __init__(self, x9):
+        self.x9 = x9
+        self.started = time.time()
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+        self.packets = 0
+        self.stats_file = None
+        self.last_stats = 0
+        self.server = None
+
+    @staticmethod
+    def _timed(histogram, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
             try:
-                os.unlink(popped.name)
-            except:
-                pass
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
 
-    def push_pane(self, a_pane):
+        return wrapper
+
+    def instrument(self):
         """
-        push appends a_pane to self.panes
+        instrument wraps the stage methods of self.x9
         """
-        self.panes.append(a_pane)
+        for stage, (member, method) in self.STAGES.items():
+            obj = getattr(self.x9, member) if member else self.x9
+            setattr(obj, method, self._timed(self.histograms[stage], getattr(obj, method)))
+        write_segment = self.x9._write_segment
 
-    def all_panes(self):
+        def _write_segment():
+            self.packets += self.x9.active_segment.tell() // PKT_SIZE
+            write_segment()
+            if self.stats_file and time.time() - self.last_stats >= self.STATS_SECS:
+                self.write_stats()
+
+        self.x9._write_segment = _write_segment
+
+    def gauges(self):
         """
-        all_panes returns the current window panes joined.
+        gauges returns a dict of gauge values,
+        names ending in _total are counters.
         """
-        return "".join([a_pane.get() for a_pane in self.panes])
+        x9 = self.x9
+        uptime = max(time.time() - self.started, 0.001)
+        return {
+            "packets_total": self.packets,
+            "packets_per_second": round(self.packets / uptime, 3),
+            "segments": x9.segnum or 0,
+            "window_length": len(x9.window.panes),
+            "sidecar_cues": len(x9.sidecar),
+            "writer_queue_depth": x9.writer.depth(),
+            "pacing_drift_seconds": round(x9.timer.drift, 6),
+            "pacing_max_drift_seconds": round(x9.timer.max_drift, 6),
+            "pacing_lateness_seconds": round(x9.timer.lateness, 6),
+            "pacing_late_total": x9.timer.late,
+            "pacing_anchors_total": x9.timer.anchors,
+            "reaper_pending": len(x9.reaper),
+            "reaper_deleted_total": x9.reaper.deleted,
+            "reaper_failures_total": x9.reaper.failures,
+            "uptime_seconds": round(uptime, 3),
+        }
 
-    def slide_panes(self, a_pane=None):
+    def render(self):
         """
-        slide calls self.push_pane with a_pane
-        and then calls self.popleft_pane to trim self.panes
-        as needed.
+        render returns the metrics in Prometheus text format.
         """
-        if a_pane:
-            self.push_pane(a_pane)
-        if len(self.panes) > self.size:
-            self.popleft_pane()
+        lines = []
+        for gauge, value in self.gauges().items():
+            kind = "counter" if gauge.endswith("_total") else "gauge"
+            lines.append(f"# TYPE x9k3_{gauge} {kind}")
+            lines.append(f"x9k3_{gauge} {value}")
+        lines.append("# TYPE x9k3_stage_seconds histogram")
+        for stage, histogram in self.histograms.items():
+            lines += histogram.lines("x9k3_stage_seconds", f'stage="{stage}"')
+        return "\n".join(lines) + "\n"
+
+    def write_stats(self):
+        """
+        write_stats rewrites the stats file.
+        """
+        self.last_stats = time.time()
+        PlaylistWriter.replace(self.stats_file, self.render())
+
+    def serve(self, port):
+        """
+        serve starts a http server thread
+        for /metrics on 127.0.0.1:port.
+        """
+        from http import server  # pylint: disable=import-outside-toplevel
+
+        metrics = self
+
+        class Handler(server.BaseHTTPRequestHandler):
+            """
+            Handler serves /metrics
+            """
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                do_GET sends the metrics
+                """
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self.server = server.HTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """
+        close writes the stats file a last time
+        and stops the http server.
+        """
+        if self.stats_file:
+            self.write_stats()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
 
 
 class Timer:
     """
-    Timer class instances are used for
-    segment duration, and live throttling.
+    Timer paces live segments to real time.
+
+    The first throttle anchors a monotonic clock to the stream,
+    after that each segment is due at the anchor plus the media time
+    throttled so far, the sum of segment PTS durations,
+    so PTS resets at discontinuities and replay loops
+    don't move the schedule.
+
+    Sleep overshoot and slow writes don't add up,
+    a late segment is made up by shorter sleeps after it.
+    When more than max_late seconds behind,
+    like after a stalled input, the clock is anchored again.
+
+        drift       publish time less due time
+                    of the last segment, + is late.
+        lateness    how far past due the next segment was
+                    when the last one was published, 0 when on time.
+        late        count of segments that were past due.
+        anchors     count of anchors.
     """
 
-    def __init__(self):
+    def __init__(self, max_late=None):
+        self.max_late = max_late
         self.begin = None
-        self.end = None
-        self.lap_time = None
+        self.media = 0.0
+        self.drift = 0.0
+        self.max_drift = 0.0
+        self.lateness = 0.0
+        self.late = 0
+        self.anchors = 0
 
     def start(self, begin=None):
         """
-        start starts the timer
+        start anchors the clock at begin,
+        a time.monotonic() value, or now.
         """
-        self.begin = begin
-        if not self.begin:
-            self.begin = time.time()
-        self.end = None
-        self.lap_time = None
+        self.begin = time.monotonic() if begin is None else begin
+        self.media = 0.0
+        self.anchors += 1
 
-    def stop(self, end=None):
+    def follow(self, timer):
         """
-        stop stops the timer
+        follow continues the schedule of timer,
+        for a new X9K3 instance on the same stream.
         """
-        self.end = end
-        if not self.end:
-            self.end = time.time()
-        self.lap_time = self.end - self.begin
+        self.begin = timer.begin
+        self.media = timer.media
 
     def elapsed(self, now=None):
         """
-        elapsed returns the elapsed time
+        elapsed returns the seconds since the anchor.
         """
-        if not now:
-            now = time.time()
+        if now is None:
+            now = time.monotonic()
         return now - self.begin
 
-    def throttle(self, seg_time, begin=None, end=None):
+    def throttle(self, seg_time):
         """
-        throttle is called to slow segment creation
+        throttle is called after a segment of seg_time seconds
+        is published, it sleeps until the next segment is due
         to simulate live streaming.
         """
-        self.stop(end)
-        diff = round(seg_time - self.lap_time, 2)
-        if diff > 0:
-            print2(f"throttling {diff}")
-            time.sleep(diff)
-        self.start(begin)
+        if self.begin is None:
+            self.start()
+        self.drift = self.elapsed() - self.media
+        self.max_drift = max(self.max_drift, self.drift)
+        self.media += seg_time
+        wait = self.media - self.elapsed()
+        self.lateness = max(-wait, 0.0)
+        if wait > 0:
+            print2(f"throttling {round(wait, 2)}")
+            time.sleep(wait)
+            return
+        self.late += 1
+        if self.max_late is not None and self.lateness > self.max_late:
+            print2(f"{round(self.lateness, 2)} seconds late, anchoring again")
+            self.start()
 
 
 class Chunk:
@@ -855,13 +3802,23 @@ class Chunk:
         self.file = file
         self.name = name
         self.num = num
+        self.parts = []
+        self.text = None
 
     def get(self):
         """
         get returns the Chunk data formated.
+        The formated text is cached until a tag is added.
         """
+        if self.text is None:
+            self.text = self._format()
+        return self.text
+
+    def _format(self):
         this = []
         for kay, vee in self.tags.items():
+            if self.parts and kay == "#EXTINF":
+                this += self.parts
             if vee is None:
                 this.append(kay)
             else:
@@ -876,12 +3833,105 @@ class Chunk:
         add_tag appends key and value for a hls tag
         """
         self.tags[quay] = val
+        self.text = None
+
+
+class PartTail:
+    """
+    PartTail is the end of a LL-HLS playlist,
+    the parts of the segment being cut
+    and the preload hint for the next part.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def get(self):
+        """
+        get returns the PartTail text.
+        """
+        return self.text
+
 
+class Config:
+    """
+    Config holds the settings for a X9K3 instance,
+    the same settings as the x9k3 command line args.
+
+        x9 = X9K3(args=Config(input="vid.ts", output_dir="out", live=True))
+
+    Unknown settings, and settings of the wrong type,
+    raise a ValueError. input None is stdin.
+    """
+
+    # name: (types, default)
+    FIELDS = {
+        "input": (object, None),
+        "batch": (bool, False),
+        "continue_m3u8": (bool, False),
+        "checkpoint": (bool, False),
+        "delete": (bool, False),
+        "delete_grace": ((int, float), None),
+        "live": (bool, False),
+        "no_discontinuity": (bool, False),
+        "output_dir": (str, "."),
+        "program_date_time": (bool, False),
+        "prefetch": (int, 0),
+        "part_time": ((int, float), None),
+        "pts_index": (bool, False),
+        "mmap": (bool, False),
+        "parallel": (int, 0),
+        "index_cache": (str, None),
+        "byterange": ((int, float), None),
+        "replay": (bool, False),
+        "sidecar_file": (str, None),
+        "sidecar_interval": ((int, float), None),
+        "segment_buffer": (str, "memory"),
+        "shulga": (bool, False),
+        "time": ((int, float), 2),
+        "hls_tag": (str, "x_cue"),
+        "writer_queue": (int, 0),
+        "writer_policy": (str, "block"),
+        "metrics_port": (int, None),
+        "stats_file": (str, None),
+        "serve_port": (int, None),
+        "serve_host": (str, "0.0.0.0"),
+        "no_disk": (bool, False),
+        "window_size": (int, 5),
+        "version": (bool, False),
+    }
+
+    # name: allowed values
+    CHOICES = {
+        "writer_policy": SegmentWriter.POLICIES,
+    }
+
+    def __init__(self, **kwargs):
+        for name, (_, default) in self.FIELDS.items():
+            setattr(self, name, default)
+        for name, value in kwargs.items():
+            if name not in self.FIELDS:
+                raise ValueError(f"unknown x9k3 setting {name}")
+            types = self.FIELDS[name][0]
+            if value is not None and not isinstance(value, types):
+                raise ValueError(f"x9k3 setting {name} can not be {value!r}")
+            if name in self.CHOICES and value not in self.CHOICES[name]:
+                raise ValueError(f"x9k3 setting {name} must be in {self.CHOICES[name]}")
+            setattr(self, name, value)
+
+    def __repr__(self):
+        settings = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"Config({settings})"
 
-def argue():
+
+def argue(argv=None):
     """
-    argue parse command line args
+    argue parse command line args,
+    or argv when it is set,
+    and returns a Config.
     """
+    import argparse  # pylint: disable=import-outside-toplevel
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-i",
@@ -894,6 +3944,21 @@ def argue():
                                 [default: stdin]
                                 """,
     )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        action="store_const",
+        default=False,
+        const=True,
+        help="Flag for batched packet scanning, uses numpy if installed [default:False]",
+    )
+    parser.add_argument(
+        "--byterange",
+        default=None,
+        type=float,
+        help="""Minutes of segments per rolling media file,
+        segments are listed with #EXT-X-BYTERANGE [default:None]""",
+    )
     parser.add_argument(
         "-c",
         "--continue_m3u8",
@@ -902,6 +3967,14 @@ def argue():
         const=True,
         help="Resume writing index.m3u8 [default:False]",
     )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_const",
+        default=False,
+        const=True,
+        help="""Flag to save state next to index.m3u8 after each segment,
+        and resume from it with --continue_m3u8 and --replay [default:False]""",
+    )
     parser.add_argument(
         "-d",
         "--delete",
@@ -910,6 +3983,19 @@ def argue():
         const=True,
         help="delete segments (enables --live) [default:False]",
     )
+    parser.add_argument(
+        "--delete_grace",
+        default=None,
+        type=float,
+        help="""Seconds to keep segments after they leave the window with --delete
+        [default:(window_size + 1) * time]""",
+    )
+    parser.add_argument(
+        "--index_cache",
+        default=None,
+        help="""Directory to cache keyframe and cue scans of VOD file inputs,
+        later runs cut segments from the cached scan [default:None]""",
+    )
     parser.add_argument(
         "-l",
         "--live",
@@ -918,6 +4004,14 @@ def argue():
         const=True,
         help="Flag for a live event (enables sliding window m3u8) [default:False]",
     )
+    parser.add_argument(
+        "--mmap",
+        action="store_const",
+        default=False,
+        const=True,
+        help="""Flag to memory map a local file input,
+        segments are written from the mapping [default:False]""",
+    )
     parser.add_argument(
         "-n",
         "--no_discontinuity",
@@ -941,6 +4035,35 @@ def argue():
         const=True,
         help="Flag to add Program Date Time tags to index.m3u8 ( enables --live) [default:False]",
     )
+    parser.add_argument(
+        "--parallel",
+        default=0,
+        type=int,
+        help="""Number of worker processes to scan a VOD file input with,
+        split at keyframes [default:0]""",
+    )
+    parser.add_argument(
+        "--prefetch",
+        default=0,
+        type=int,
+        help="""Number of m3u8 input segments to download
+        while parsing the current one [default:0]""",
+    )
+    parser.add_argument(
+        "--part_time",
+        default=None,
+        type=float,
+        help="""LL-HLS part time in seconds, cuts #EXT-X-PART
+        partial segments (enables --live) [default:None]""",
+    )
+    parser.add_argument(
+        "--pts_index",
+        action="store_const",
+        default=False,
+        const=True,
+        help="""Flag to write a binary index of keyframe, segment and
+        SCTE-35 cue PTS to input byte offsets, index.m3u8.idx [default:False]""",
+    )
     parser.add_argument(
         "-r",
         "--replay",
@@ -957,6 +4080,20 @@ def argue():
         default=None,
         help="""Sidecar file of SCTE-35 (pts,cue) pairs.[default:None]""",
     )
+    parser.add_argument(
+        "--sidecar_interval",
+        default=None,
+        type=float,
+        help="""Seconds between sidecar file checks
+        [default: once per segment]""",
+    )
+    parser.add_argument(
+        "--segment_buffer",
+        default="memory",
+        help="""memory, pool, or file.
+        pool reuses preallocated buffers,
+        file writes packets through to a temp file [default:memory]""",
+    )
     parser.add_argument(
         "-S",
         "--shulga",
@@ -979,6 +4116,52 @@ def argue():
         help="x_scte35, x_cue, x_daterange, or x_splicepoint [default:x_cue]",
     )
 
+    parser.add_argument(
+        "--writer_queue",
+        default=0,
+        type=int,
+        help="""Segment writer queue size, writes segments on a background thread
+        0 writes on the parsing thread [default:0]""",
+    )
+    parser.add_argument(
+        "--writer_policy",
+        default="block",
+        choices=SegmentWriter.POLICIES,
+        help="block, drop, or alarm when the writer queue is full [default:block]",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        default=None,
+        type=int,
+        help="""Serve Prometheus metrics on
+        http://127.0.0.1:METRICS_PORT/metrics [default:None]""",
+    )
+    parser.add_argument(
+        "--stats_file",
+        default=None,
+        help="""File rewritten with Prometheus metrics
+        every 5 seconds [default:None]""",
+    )
+    parser.add_argument(
+        "--serve_port",
+        default=None,
+        type=int,
+        help="""Serve index.m3u8 and segments from memory
+        on SERVE_PORT [default:None]""",
+    )
+    parser.add_argument(
+        "--serve_host",
+        default="0.0.0.0",
+        help="Address to serve on with --serve_port [default:0.0.0.0]",
+    )
+    parser.add_argument(
+        "--no_disk",
+        action="store_const",
+        default=False,
+        const=True,
+        help="""Flag to keep segments and index.m3u8 only in memory,
+        needs --serve_port [default:False]""",
+    )
     parser.add_argument(
         "-w",
         "--window_size",
@@ -994,7 +4177,7 @@ def argue():
         const=True,
         help="Show version",
     )
-    return parser.parse_args()
+    return Config(**vars(parser.parse_args(argv)))
 
 
 def cli():
@@ -1005,12 +4188,15 @@ def cli():
      cli()
     """
     args = argue()
-    x9 = X9K3()
+    x9 = X9K3(args=args)
     x9.decode()
     while args.replay:
-        x9 = X9K3()
-        x9.continue_m3u8()
-        x9.decode()
+        if not x9.replay_cached():
+            last = x9
+            x9 = X9K3(args=args)
+            x9.follow(last)
+            x9.continue_m3u8()
+            x9.decode()
 
 
 if __name__ == "__main__":
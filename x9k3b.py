@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+"""
+x9k3b
+
+Segment a directory, or manifest, of VOD inputs
+with a pool of worker processes.
+
+Each input is a X9K3 job. Worker processes are reused
+for job after job, so there is one interpreter start
+per worker, not per file. A summary report
+of every job is written when the batch is done.
+
+A directory is every .ts file in it, each segmented
+to output_dir/name/, with name.txt as it's sidecar file
+when there is one.
+
+A manifest has one job per line, an input
+followed by x9k3 args.
+
+    # input          x9k3 args
+    /vod/a.ts        -t 4
+    /vod/b.ts        -t 6 -s /vod/b-breaks.txt -o /hls/b-six
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import shlex
+import time
+from threefive import print2
+from x9k3 import X9K3, argue
+
+
+class JobX9K3(X9K3):
+    """
+    JobX9K3 is X9K3 for one x9k3b job,
+    it counts segments and media seconds,
+    and doesn't sleep after the last segment.
+    """
+
+    def __init__(self, args):
+        super().__init__(args=args)
+        self.end_sleep = 0
+        self.segments = 0
+        self.media_secs = 0.0
+        self.bytes = 0
+
+    def _write_segment(self):
+        nbytes = self.active_segment.tell()
+        segnum = self.segnum or 0
+        super()._write_segment()
+        if self.segnum is not None and self.segnum != segnum:
+            self.segments += 1
+            self.media_secs += float(
+                self.window.panes[-1].tags["#EXTINF"].rstrip(",")
+            )
+            self.bytes += nbytes
+
+
+def run_job(job):
+    """
+    run_job segments one input,
+    it runs in a worker process.
+    """
+    name, argv = job
+    result = {
+        "name": name,
+        "argv": argv,
+        "ok": False,
+        "error": None,
+        "seconds": 0.0,
+        "segments": 0,
+        "media_secs": 0.0,
+        "bytes": 0,
+        "worker": mp.current_process().name,
+    }
+    start = time.perf_counter()
+    try:
+        x9 = JobX9K3(argue(argv))
+        x9.decode()
+        result.update(
+            ok=True,
+            segments=x9.segments,
+            media_secs=round(x9.media_secs, 6),
+            bytes=x9.bytes,
+        )
+    except (Exception, SystemExit) as err:  # pylint: disable=broad-except
+        result["error"] = repr(err)
+    result["seconds"] = round(time.perf_counter() - start, 6)
+    return result
+
+
+def chk_argv(argv):
+    """
+    chk_argv returns None when argv are good x9k3 args,
+    or else the error.
+    """
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(err), contextlib.redirect_stdout(err):
+            argue(argv)
+    except (ValueError, SystemExit) as exc:
+        lines = err.getvalue().strip().splitlines()
+        return lines[-1] if lines else repr(exc)
+    return None
+
+
+def sets_output_dir(argv):
+    """
+    sets_output_dir returns True when argv sets the output dir,
+    as -o X, -oX, --output_dir=X or an abbreviation.
+    """
+    unset = "\0"
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(err), contextlib.redirect_stdout(err):
+            return argue(["-o", unset] + argv).output_dir != unset
+    except (ValueError, SystemExit):
+        return False
+
+
+class X9K3B:
+    """
+    X9K3B runs X9K3 jobs on a process pool.
+    """
+
+    def __init__(self, source, output_dir=".", workers=None, x9k3_args=None):
+        self.source = source
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.x9k3_args = x9k3_args or []
+        self.jobs = []
+        self.results = []
+        self.wall = 0.0
+
+    def _job(self, ts_file, argv):
+        name = os.path.splitext(os.path.basename(ts_file))[0]
+        if not sets_output_dir(argv):
+            argv = argv + ["-o", X9K3.mk_uri(self.output_dir, name)]
+        return name, ["-i", ts_file] + self.x9k3_args + argv
+
+    def _load_dir(self):
+        for ts_file in sorted(os.listdir(self.source)):
+            if not ts_file.endswith(".ts"):
+                continue
+            argv = []
+            sidecar = X9K3.mk_uri(self.source, f"{ts_file[:-3]}.txt")
+            if os.path.isfile(sidecar):
+                argv = ["-s", sidecar]
+            self.jobs.append(self._job(X9K3.mk_uri(self.source, ts_file), argv))
+
+    def _load_manifest(self):
+        with open(self.source, encoding="utf8") as manifest:
+            for line in manifest:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    ts_file, *argv = shlex.split(line)
+                    self.jobs.append(self._job(ts_file, argv))
+
+    def _chk_jobs(self):
+        """
+        _chk_jobs parses the args of each job, a job
+        with bad args is a failed result, and isn't run.
+        """
+        jobs = []
+        for name, argv in self.jobs:
+            error = chk_argv(argv)
+            if error is None:
+                jobs.append((name, argv))
+                continue
+            print2(f"{name}  failed: {error}")
+            self.results.append(
+                {
+                    "name": name,
+                    "argv": argv,
+                    "ok": False,
+                    "error": error,
+                    "seconds": 0.0,
+                    "segments": 0,
+                    "media_secs": 0.0,
+                    "bytes": 0,
+                    "worker": None,
+                }
+            )
+        self.jobs = jobs
+
+    def load_jobs(self):
+        """
+        load_jobs makes a job for each input
+        in the source directory or manifest,
+        and checks the args of each job.
+        """
+        if os.path.isdir(self.source):
+            self._load_dir()
+        else:
+            self._load_manifest()
+        names = [name for name, _ in self.jobs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"{self.source} has inputs with the same name")
+        if not self.jobs:
+            raise ValueError(f"{self.source} has no inputs")
+        self._chk_jobs()
+
+    def run(self):
+        """
+        run runs every job and returns the summary.
+        """
+        self.load_jobs()
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        workers = max(min(self.workers, len(self.jobs)), 1)
+        start = time.perf_counter()
+        if self.jobs:
+            with mp.Pool(workers) as pool:
+                for result in pool.imap_unordered(run_job, self.jobs):
+                    status = "done" if result["ok"] else f"failed: {result['error']}"
+                    print2(f"{result['name']}  {status}  {result['seconds']:.3f}s")
+                    self.results.append(result)
+        self.wall = time.perf_counter() - start
+        return self.summary(workers)
+
+    def summary(self, workers):
+        """
+        summary returns totals for the batch and each job.
+        speedup is job seconds per wall second,
+        close to workers when the batch scales.
+        """
+        wall = max(self.wall, 0.000001)
+        done = [result for result in self.results if result["ok"]]
+        job_secs = sum(result["seconds"] for result in self.results)
+        media_secs = sum(result["media_secs"] for result in done)
+        nbytes = sum(result["bytes"] for result in done)
+        return {
+            "workers": workers,
+            "jobs": len(self.results),
+            "failures": len(self.results) - len(done),
+            "wall_seconds": round(wall, 3),
+            "job_seconds": round(job_secs, 3),
+            "speedup": round(job_secs / wall, 3),
+            "segments": sum(result["segments"] for result in done),
+            "media_seconds": round(media_secs, 3),
+            "realtime": round(media_secs / wall, 3),
+            "mbps": round(nbytes * 8 / wall / 1000000, 3),
+            "results": sorted(self.results, key=lambda result: result["name"]),
+        }
+
+
+def cli():
+    """
+    cli runs x9k3b, args it doesn't know
+    are passed to every x9k3 job.
+    x9k3b's own options, other than -i and -o,
+    are long only, so they don't shadow x9k3's.
+
+     from x9k3b import cli
+     cli()
+    """
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument(
+        "-i",
+        "--input",
+        required=True,
+        help="Directory of .ts files, or a manifest file of inputs and x9k3 args",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        default=".",
+        help="Directory for a directory of output per input [default:'.']",
+    )
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of worker processes [default:cpu count]",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="Summary report JSON file [default:OUTPUT_DIR/x9k3b.json]",
+    )
+    args, x9k3_args = parser.parse_known_args()
+    batch = X9K3B(args.input, args.output_dir, args.workers, x9k3_args)
+    summary = batch.run()
+    report = args.report or X9K3.mk_uri(args.output_dir, "x9k3b.json")
+    with open(report, "w", encoding="utf8") as report_file:
+        json.dump(summary, report_file, indent=3)
+    print2(
+        f"{summary['jobs']} jobs   {summary['failures']} failed"
+        f"   {summary['wall_seconds']}s   {summary['realtime']}x realtime"
+        f"   speedup {summary['speedup']} on {summary['workers']} workers"
+    )
+    print2(f"report: {report}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+"""
+x9k3d
+
+Run many x9k3 channels from one supervisor.
+
+x9k3d reads a channel config file, starts a worker process
+per cpu core, and runs each channel as a X9K3 thread
+in the least loaded worker when it starts or restarts.
+Running channels are not moved. Failed channels are restarted,
+and throughput for every channel is reported in one place.
+
+A channel config file has one channel per line,
+a name followed by x9k3 args.
+
+    # name   x9k3 args
+    news     -i udp://@235.35.3.5:3535 -o /var/hls/news -l
+    sports   -i udp://@235.35.3.6:3536 -o /var/hls/sports -l -s sports.txt
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import shlex
+import threading
+import time
+from threefive import print2
+from x9k3 import X9K3, argue
+
+
+REPORT_SECS = 10
+POLL_SECS = 0.5
+RESTART_SECS = 1
+MAX_RESTART_SECS = 60
+
+
+class Channel:
+    """
+    Channel holds a channel name, it's x9k3 args,
+    the worker it runs in, and it's stats.
+    """
+
+    def __init__(self, name, argv):
+        self.name = name
+        self.argv = argv
+        self.worker = None
+        self.running = False
+        self.up = None
+        self.down = None
+        self.error = None
+        self.done = False
+        self.restarts = 0
+        self.restart_at = None
+        self.segments = 0
+        self.bytes = 0
+        self.media_secs = 0.0
+        self.cpu_secs = 0.0
+        self.load = None
+        self.last_seen = None
+
+    def throughput(self, now):
+        """
+        throughput returns bits per second of segments written,
+        and media seconds segmented per wall clock second.
+        """
+        if not self.up:
+            return 0.0, 0.0
+        wall = max((self.down or now) - self.up, 0.001)
+        return self.bytes * 8 / wall, self.media_secs / wall
+
+    def health(self, now):
+        """
+        health returns up, done, restarting, stalled or failed.
+        """
+        if self.done:
+            return "done"
+        if self.restart_at:
+            return "restarting"
+        if self.error and not self.running:
+            return "failed"
+        if self.last_seen and now - self.last_seen > REPORT_SECS * 3:
+            return "stalled"
+        return "up"
+
+
+class ChannelX9K3(X9K3):
+    """
+    ChannelX9K3 is X9K3 for one channel of x9k3d.
+    It sends segment stats and the cpu time
+    used by it's thread to the supervisor.
+    """
+
+    def __init__(self, name, events):
+        super().__init__()
+        self.name = name
+        self.events = events
+        self.cpu_mark = time.thread_time()
+
+    def _segment_event(self, seg_time, nbytes):
+        cpu = time.thread_time()
+        self.events.put(("segment", self.name, seg_time, nbytes, cpu - self.cpu_mark))
+        self.cpu_mark = cpu
+
+    def _write_segment(self):
+        nbytes = self.active_segment.tell()
+        segnum = self.segnum or 0
+        super()._write_segment()
+        if self.segnum is not None and self.segnum != segnum:
+            seg_time = float(self.window.panes[-1].tags["#EXTINF"].rstrip(","))
+            self._segment_event(seg_time, nbytes)
+
+    def _replay_segment(self, kept, nbytes, start, seg_time, tags):
+        super()._replay_segment(kept, nbytes, start, seg_time, tags)
+        self._segment_event(seg_time, nbytes)
+
+
+def run_channel(name, argv, events):
+    """
+    run_channel segments one channel,
+    it is the target of each channel thread.
+    """
+    events.put(("up", name, time.time()))
+    try:
+        args = argue(argv)
+        x9 = ChannelX9K3(name, events)
+        x9.args = args
+        x9.decode()
+        while args.replay:
+            if not x9.replay_cached():
+                last = x9
+                x9 = ChannelX9K3(name, events)
+                x9.args = args
+                x9.follow(last)
+                x9.continue_m3u8()
+                x9.decode()
+    except BaseException as err:  # pylint: disable=broad-except
+        events.put(("error", name, repr(err)))
+    finally:
+        events.put(("down", name, time.time()))
+
+
+def run_worker(cmds, events):
+    """
+    run_worker starts a thread for each channel sent on cmds,
+    it is the target of each worker process.
+    """
+    while True:
+        cmd = cmds.get()
+        if cmd is None:
+            return
+        name, argv = cmd
+        threading.Thread(
+            target=run_channel, args=(name, argv, events), name=name, daemon=True
+        ).start()
+
+
+class X9K3D:
+    """
+    X9K3D runs channels across a pool of worker processes.
+    """
+
+    def __init__(self, config, workers=None):
+        self.config = config
+        self.workers = workers or os.cpu_count() or 1
+        self.channels = {}
+        self.procs = []
+        self.cmds = []
+        self.events = mp.Queue()
+        self.last_report = 0
+
+    def load_config(self):
+        """
+        load_config reads channels from the config file.
+        """
+        with open(self.config, encoding="utf8") as config:
+            for line in config:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                name, *argv = shlex.split(line)
+                if name in self.channels:
+                    raise ValueError(f"{self.config} has channel {name} twice")
+                self.channels[name] = Channel(name, argv)
+        if not self.channels:
+            raise ValueError(f"{self.config} has no channels")
+
+    def _spawn_worker(self, wid):
+        cmds = mp.Queue()
+        proc = mp.Process(
+            target=run_worker, args=(cmds, self.events), name=f"Worker-{wid}"
+        )
+        proc.start()
+        self.cmds[wid] = cmds
+        self.procs[wid] = proc
+
+    def start_workers(self):
+        """
+        start_workers starts the worker processes.
+        """
+        self.workers = min(self.workers, len(self.channels))
+        self.cmds = [None] * self.workers
+        self.procs = [None] * self.workers
+        for wid in range(self.workers):
+            self._spawn_worker(wid)
+
+    def _default_load(self):
+        loads = [chan.load for chan in self.channels.values() if chan.load is not None]
+        if loads:
+            return sum(loads) / len(loads)
+        return 1.0
+
+    def worker_load(self, wid):
+        """
+        worker_load returns the sum of the measured load
+        of the channels running in worker wid.
+        Channels with no measurements yet
+        count as the average channel.
+        """
+        default = self._default_load()
+        return sum(
+            default if chan.load is None else chan.load
+            for chan in self.channels.values()
+            if chan.running and chan.worker == wid
+        )
+
+    def assign(self, chan):
+        """
+        assign starts chan in the least loaded worker.
+        It's only called when chan starts or restarts,
+        before any channel is measured every worker
+        has the same load per channel.
+        """
+        wid = min(range(self.workers), key=self.worker_load)
+        chan.worker = wid
+        chan.running = True
+        chan.restart_at = None
+        self.cmds[wid].put((chan.name, chan.argv))
+
+    def _event(self, event):
+        kind, name = event[0], event[1]
+        chan = self.channels[name]
+        chan.last_seen = time.time()
+        if kind == "up":
+            chan.up = event[2]
+            chan.down = None
+            print2(f"{name}  is up on Worker-{chan.worker}")
+        if kind == "segment":
+            chan.segments += 1
+            chan.media_secs += event[2]
+            chan.bytes += event[3]
+            chan.cpu_secs += event[4]
+            if event[2]:
+                load = event[4] / event[2]
+                chan.load = load if chan.load is None else 0.8 * chan.load + 0.2 * load
+        if kind == "error":
+            chan.error = event[2]
+            print2(f"{name}  failed: {chan.error}")
+        if kind == "down":
+            chan.down = event[2]
+            chan.running = False
+            if chan.error:
+                self._restart_later(chan)
+            else:
+                chan.done = True
+                print2(f"{name}  is done")
+
+    def _restart_later(self, chan):
+        wait = min(RESTART_SECS * 2**chan.restarts, MAX_RESTART_SECS)
+        chan.restart_at = time.time() + wait
+        print2(f"{chan.name}  restarting in {wait}s")
+
+    def chk_restarts(self):
+        """
+        chk_restarts restarts failed channels that are due.
+        """
+        now = time.time()
+        for chan in self.channels.values():
+            if chan.restart_at and chan.restart_at <= now:
+                chan.restarts += 1
+                chan.error = None
+                self.assign(chan)
+
+    def chk_workers(self):
+        """
+        chk_workers replaces dead worker processes
+        and restarts the channels that were running in them.
+        """
+        for wid, proc in enumerate(self.procs):
+            if proc.is_alive():
+                continue
+            print2(f"{proc.name}  died, exit code {proc.exitcode}")
+            self._spawn_worker(wid)
+            for chan in self.channels.values():
+                if chan.running and chan.worker == wid:
+                    chan.running = False
+                    chan.error = f"{proc.name} died"
+                    self._restart_later(chan)
+
+    def report(self):
+        """
+        report prints health, load and throughput for each channel,
+        and the load of each worker.
+        """
+        now = time.time()
+        for chan in self.channels.values():
+            bps, speed = chan.throughput(now)
+            load = chan.load or 0.0
+            print2(
+                f"{chan.name}  Worker-{chan.worker}  {chan.health(now)}"
+                f"   segments: {chan.segments}   restarts: {chan.restarts}"
+                f"   {bps / 1000000:.3f} Mbps   {speed:.2f}x realtime"
+                f"   load: {load:.3f}"
+            )
+        for wid in range(self.workers):
+            print2(f"Worker-{wid}  load: {self.worker_load(wid):.3f}")
+        self.last_report = now
+
+    def active(self):
+        """
+        active returns True while any channel
+        is running or waiting to restart.
+        """
+        return any(
+            chan.running or chan.restart_at for chan in self.channels.values()
+        )
+
+    def _drain(self):
+        while True:
+            try:
+                self._event(self.events.get(timeout=POLL_SECS))
+            except queue.Empty:
+                return
+
+    def stop(self):
+        """
+        stop stops the worker processes.
+        """
+        for proc in self.procs:
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self.procs:
+            proc.join()
+
+    def run(self):
+        """
+        run runs the channels until they are all done.
+        """
+        self.load_config()
+        self.start_workers()
+        for chan in self.channels.values():
+            self.assign(chan)
+        self.last_report = time.time()
+        try:
+            while self.active():
+                self._drain()
+                self.chk_workers()
+                self.chk_restarts()
+                if time.time() - self.last_report >= REPORT_SECS:
+                    self.report()
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+        self._drain()
+        self.report()
+
+
+def cli():
+    """
+    cli runs x9k3d
+
+     from x9k3d import cli
+     cli()
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-c",
+        "--config",
+        required=True,
+        help="""Channel config file, one channel per line,
+        a name followed by x9k3 args""",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of worker processes [default:cpu count]",
+    )
+    args = parser.parse_args()
+    X9K3D(args.config, args.workers).run()
+
+
+if __name__ == "__main__":
+    cli()